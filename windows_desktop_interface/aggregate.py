@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+"""
+This file contains the aggregation of the outputs of the areas into the scores of an exam.
+
+The class probabilities of the 14 areas are kept in a 14 x K matrix: the score of every
+area, the number of areas of each severity, the number of pathological areas and the
+confidence of the exam are computed from it with numpy, and only the row of an area is
+recomputed when that area is scored again.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import numpy as np
+from results import KEYS, KEY_INDEX, N_SEVERITIES, NOT_MEASURED
+
+
+def severity_probabilities(probabilities, n_classes=N_SEVERITIES):
+    """
+    Returns the probabilities of the severity classes from the output of the model for a video.
+    The first n_classes outputs of the model are the severity classes, renormalized.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float32)[:n_classes]
+    total = probabilities.sum()
+    if total <= 0:
+        return np.full(n_classes, 1.0 / n_classes, dtype=np.float32)
+    return probabilities / total
+
+
+class ScoreAggregator:
+    """
+    Incremental aggregation of the class probabilities of the areas of an exam.
+
+    :param n_classes: number of severity classes K
+    """
+    def __init__(self, n_classes=N_SEVERITIES):
+        self.n_classes = n_classes
+        self.reset()
+
+    def reset(self):
+        """ Marks all the areas as not measured """
+        self.probabilities = np.zeros((len(KEYS), self.n_classes), dtype=np.float32)
+        self.measured = np.zeros(len(KEYS), dtype=bool)
+        self.aggregate()
+
+    def aggregate(self):
+        """ Recomputes everything from the probability matrix in a single pass """
+        self.scores = np.where(self.measured, self.probabilities.argmax(axis=1), NOT_MEASURED).astype(np.int8)
+        self.counts = np.bincount(self.scores, minlength=NOT_MEASURED + 1)
+        # Confidence of each area: the probability of its score
+        self.row_confidence = np.where(self.measured, self.probabilities.max(axis=1), 0).astype(np.float32)
+        self._confidence_sum = float(self.row_confidence.sum())
+
+    def update_row(self, key, probabilities):
+        """
+        Sets the class probabilities of an area, only its row is recomputed.
+
+        :param key: name of the area, e.g. 'left-anterior-apical'
+        :param probabilities: the K class probabilities of the area
+        """
+        i = KEY_INDEX[key]
+        row = np.asarray(probabilities, dtype=np.float32)
+        total = row.sum()
+        self.probabilities[i] = row / total if total > 0 else row
+        self._set_score(i, int(self.probabilities[i].argmax()), float(self.probabilities[i].max()))
+        self.measured[i] = True
+
+    def clear_row(self, key):
+        """ Marks an area as not measured """
+        i = KEY_INDEX[key]
+        self.probabilities[i] = 0
+        self.measured[i] = False
+        self._set_score(i, NOT_MEASURED, 0.0)
+
+    def _set_score(self, i, score, confidence):
+        self.counts[self.scores[i]] -= 1
+        self.counts[score] += 1
+        self.scores[i] = score
+        self._confidence_sum += confidence - float(self.row_confidence[i])
+        self.row_confidence[i] = confidence
+
+    @property
+    def pathological_areas(self):
+        return int(self.counts[1:NOT_MEASURED].sum())
+
+    @property
+    def confidence(self):
+        """ Mean confidence of the measured areas, 0 if no area is measured """
+        n_measured = len(KEYS) - int(self.counts[NOT_MEASURED])
+        return self._confidence_sum / n_measured if n_measured > 0 else 0.0
+
+    def apply(self, result):
+        """ Copies the scores, the probabilities and the confidence into an ExamResult """
+        result.scores = self.scores.copy()
+        result.probabilities = self.probabilities.copy()
+        result.confidence = self.confidence
+        return result
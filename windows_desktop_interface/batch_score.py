@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+"""
+This file contains the headless entry point used to score whole archives of exams
+without the graphical interface.
+
+Every folder containing at least one video is scored with the classifier and a summary
+line per folder is appended to a JSON-lines or CSV file. The folders already scored are
+recorded in a checkpoint file, so that an interrupted run can be resumed. The folders that
+could not be scored are appended to a separate failures file instead, and are retried by
+the next run.
+
+Usage: python batch_score.py ARCHIVE_DIR -o summary.jsonl [-j 4] [--sampler uniform]
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import os
+import sys
+import csv
+import json
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+
+VIDEO_EXTENSIONS = (".avi",)
+CSV_FIELDS = ['folder', 'name', 'status', 'n_videos', 'results', 'error']
+
+# Classifier of the worker process, created once by init_worker
+_classifier = None
+
+
+def find_exam_folders(root):
+    """ Returns, in a stable order, the folders under root that contain at least one video """
+    folders = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        if any(name.lower().endswith(VIDEO_EXTENSIONS) for name in file_names):
+            folders.append(os.path.abspath(dir_path))
+    return folders
+
+
+def init_worker(model_path, sampler_name, n_frames, batch_size, engine="tf", n_workers=None, quantization="dynamic"):
+    """ Creates the classifier of a worker process, the model is loaded once per process """
+    global _classifier
+    from samplers import make_sampler
+
+    sampler = make_sampler(sampler_name, n_frames=n_frames)
+    if engine == "process":
+        from process_pool import ProcessPoolClassifier
+        _classifier = ProcessPoolClassifier(model_path=model_path, batch_size=batch_size, sampler=sampler,
+                                            n_workers=n_workers)
+    elif engine == "tflite":
+        from tflite_classifier import TFLiteClassifier
+        _classifier = TFLiteClassifier(model_path=model_path, quantization=quantization, batch_size=batch_size,
+                                       sampler=sampler)
+    else:
+        from classifiers import TFClassifier
+        _classifier = TFClassifier(model_path=model_path, batch_size=batch_size, sampler=sampler)
+
+
+def score_folder(folder):
+    """ Scores a single exam folder, never raises so that a broken folder does not stop the run """
+    try:
+        result = _classifier.classify({'working_dir': folder})
+        results = {file: str(video.label) for file, video in result.videos.items()}
+        return {'folder': folder, 'name': result.name, 'status': "ok", 'n_videos': len(results),
+                'results': results, 'error': ""}
+    except Exception:
+        return {'folder': folder, 'name': os.path.basename(folder), 'status': "error", 'n_videos': 0,
+                'results': {}, 'error': traceback.format_exc()}
+
+
+def score_folders(folders, args):
+    """ Yields the summaries of the folders as soon as they are scored """
+    initargs = (args.model, args.sampler, args.n_frames, args.batch_size)
+
+    if args.engine == "process":
+        # A single classifier backed by a pool of inference processes shared by all the folders
+        init_worker(*initargs, engine="process", n_workers=args.jobs)
+        with ThreadPoolExecutor(args.jobs) as threads:
+            yield from threads.map(score_folder, folders)
+    else:
+        # TensorFlow does not survive a fork, the workers are started from scratch
+        if args.engine == "tflite":
+            # Convert the model once, before the workers load it
+            from tflite_classifier import prepare_model
+            calibration = [os.path.join(folder, file) for folder in folders[:8] for file in sorted(os.listdir(folder))
+                           if file.lower().endswith(VIDEO_EXTENSIONS)][:8]
+            prepare_model(args.model, args.quantization, calibration)
+        context = multiprocessing.get_context("spawn")
+        initargs += (args.engine, None, args.quantization)
+        with context.Pool(args.jobs, initializer=init_worker, initargs=initargs) as pool:
+            yield from pool.imap_unordered(score_folder, folders)
+
+
+def read_checkpoint(path):
+    """ Returns the set of folders already scored """
+    if not os.path.exists(path):
+        return set()
+    with open(path) as file:
+        return set(line.rstrip("\n") for line in file if line.strip())
+
+
+def read_summary(path):
+    """ Returns the set of folders already scored according to a summary file """
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline="") as file:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(file))
+        else:
+            rows = []
+            for line in file:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # The last line of a run that was killed while writing it
+                    pass
+    # The summaries written by older versions contain the folders that failed as well
+    return set(row['folder'] for row in rows if isinstance(row, dict) and row.get('status') == "ok")
+
+
+def failures_path(output):
+    """ Path of the file of the folders that could not be scored, e.g. summary.jsonl -> summary.failures.jsonl """
+    pre, ext = os.path.splitext(output)
+    return pre + ".failures" + ext
+
+
+def _drop_partial_line(path):
+    """ Removes the end of a file after its last newline, i.e. a line whose write was interrupted """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as file:
+        content = file.read()
+        if not content.endswith(b"\n"):
+            file.truncate(content.rfind(b"\n") + 1)
+
+
+class SummaryWriter:
+    """ Appends the summary of each folder to a JSON-lines or CSV file """
+    def __init__(self, path):
+        self.is_csv = path.lower().endswith(".csv")
+        _drop_partial_line(path)
+        write_header = self.is_csv and (not os.path.exists(path) or os.path.getsize(path) == 0)
+        self.file = open(path, "a", newline="")
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            if write_header:
+                self.writer.writeheader()
+
+    def write(self, summary):
+        if self.is_csv:
+            self.writer.writerow(dict(summary, results=json.dumps(summary['results'])))
+        else:
+            self.file.write(json.dumps(summary) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class RunRecorder:
+    """
+    Records the outcome of each folder: the folders scored get a row in the summary and then an entry
+    in the checkpoint, the others a row in the failures file. A folder that already has a row in the
+    summary is never scored again, even if the run was killed before its checkpoint entry was written.
+    """
+    def __init__(self, output, checkpoint_path, failures):
+        self.done = read_checkpoint(checkpoint_path) | read_summary(output)
+        self.summary = SummaryWriter(output)
+        self.failures = SummaryWriter(failures)
+        _drop_partial_line(checkpoint_path)
+        self.checkpoint = open(checkpoint_path, "a")
+
+    def record(self, summary):
+        if summary['status'] != "ok":
+            # Retried by the next run, every failed attempt is kept
+            self.failures.write(summary)
+            return
+        self.summary.write(summary)
+        self.checkpoint.write(summary['folder'] + "\n")
+        self.checkpoint.flush()
+        self.done.add(summary['folder'])
+
+    def close(self):
+        self.summary.close()
+        self.failures.close()
+        self.checkpoint.close()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Scores the exam folders of an archive without the GUI")
+    parser.add_argument("root", help="directory containing the exam folders")
+    parser.add_argument("-o", "--output", default="summary.jsonl", help="summary file, .jsonl or .csv")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default: OUTPUT.done)")
+    parser.add_argument("--failures", default=None,
+                        help="file of the folders that could not be scored (default: OUTPUT with .failures before the extension)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--model", default="model.hdf5", help="path of the model")
+    parser.add_argument("--sampler", default="first", help="frame sampler: first, uniform, stride, keyframe or all")
+    parser.add_argument("--n-frames", type=int, default=16, help="number of frames classified per video")
+    parser.add_argument("--batch-size", type=int, default=16, help="frames sent to the model at once")
+    parser.add_argument("--engine", choices=["tf", "tflite", "process"], default="tf",
+                        help="tf: one TFClassifier per worker process, "
+                             "tflite: one TFLiteClassifier per worker process, "
+                             "process: ProcessPoolClassifier with frames in shared memory")
+    parser.add_argument("--quantization", choices=["none", "dynamic", "int8"], default="dynamic",
+                        help="quantization of the tflite engine, int8 is calibrated on the first videos of the archive")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    checkpoint_path = args.checkpoint if args.checkpoint is not None else args.output + ".done"
+    failures = args.failures if args.failures is not None else failures_path(args.output)
+
+    recorder = RunRecorder(args.output, checkpoint_path, failures)
+    n_errors = 0
+
+    try:
+        folders = [folder for folder in find_exam_folders(args.root) if folder not in recorder.done]
+        print("{} folders to score, {} already done".format(len(folders), len(recorder.done)))
+        if len(folders) == 0:
+            return 0
+        for i, summary in enumerate(score_folders(folders, args), 1):
+            recorder.record(summary)
+            if summary['status'] != "ok":
+                n_errors += 1
+            print("[{}/{}] {}: {}".format(i, len(folders), summary['folder'], summary['status']))
+    finally:
+        recorder.close()
+
+    return 1 if n_errors > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+"""
+This file contains the benchmarks of the scoring path, runnable headless on CPU.
+
+Synthetic .avi clips and a tiny stand-in Keras model are generated, then the classification
+(frames/sec, latency percentiles per video), the rendering of the reports, the patching of
+the lung map and the ffmpeg crop are measured. The results are stored as JSON and can be
+compared with a previous run to flag the regressions.
+
+Usage: python benchmark.py -o bench.json [--compare previous.json] [--videos 4] [--frames 60]
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import functools
+import platform
+import tempfile
+import numpy as np
+
+
+RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
+
+# Whether a higher or a lower value of each metric is better
+HIGHER_IS_BETTER = "higher"
+LOWER_IS_BETTER = "lower"
+METRICS = {
+    'classify_fps': HIGHER_IS_BETTER,
+    'latency_p50_s': LOWER_IS_BETTER,
+    'latency_p90_s': LOWER_IS_BETTER,
+    'latency_p99_s': LOWER_IS_BETTER,
+    'model_load_s': LOWER_IS_BETTER,
+    'html_reports_per_s': HIGHER_IS_BETTER,
+    'pdf_reports_per_s': HIGHER_IS_BETTER,
+    'lung_map_patches_per_s': HIGHER_IS_BETTER,
+    'ffmpeg_crop_s': LOWER_IS_BETTER,
+    'peak_rss_mb': LOWER_IS_BETTER,
+}
+
+
+def make_clips(directory, n_videos=4, n_frames=60, width=640, height=480, fps=25):
+    """ Writes n_videos synthetic MJPG .avi clips with moving content, returns their paths """
+    import cv2
+    rng = np.random.default_rng(0)
+    x = np.arange(width)[np.newaxis]
+    paths = []
+    for i in range(n_videos):
+        path = os.path.join(directory, "clip{}.avi".format(i))
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+        noise = rng.integers(0, 64, (height, width), dtype=np.uint8)
+        for t in range(n_frames):
+            # Bands moving over a fixed noise, similar in cost to an ultrasound sweep
+            frame = ((np.sin((x + 4 * t) / 17.0 + i) * 80 + 100).astype(np.uint8) + noise)
+            writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+        writer.release()
+        paths.append(path)
+    return paths
+
+
+def make_model(path, input_shape=(224, 224, 3), n_classes=4):
+    """ Saves a tiny Keras model with the input and output of the real one """
+    import tensorflow as tf
+    # The 8-bit pixels are scaled to [0, 1] by the first convolution itself (see below), since
+    # the Rescaling layer does not exist in TensorFlow 2.1 and a Lambda layer cannot be reloaded safely
+    first = tf.keras.layers.Conv2D(8, 3, strides=4, activation="relu", input_shape=input_shape)
+    model = tf.keras.Sequential([
+        first,
+        tf.keras.layers.Conv2D(16, 3, strides=4, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(n_classes, activation="softmax"),
+    ])
+    kernel, bias = first.get_weights()
+    first.set_weights([kernel / 255.0, bias])
+    model.save(path)
+    return path
+
+
+def peak_rss_mb():
+    """ Peak resident memory of the process in MB, None if it cannot be measured """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+    except ImportError:
+        pass
+    # The resource module does not exist on Windows, where psutil reports the peak working set
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    except (ImportError, AttributeError):
+        return None
+
+
+def bench_classifier(classifier, videos, repeats=3):
+    """
+    Measures the classification of the videos, bypassing the result caches.
+
+    :param classifier: a callable creating the classifier, e.g. TFClassifier
+    """
+    start = time.perf_counter()
+    classifier = classifier()
+    model_load = time.perf_counter() - start
+    loaded = classifier.load_model()
+
+    latencies = []
+    frames = 0
+    for _ in range(repeats):
+        for video_path in videos:
+            start = time.perf_counter()
+            _, timings = classifier.classify_video(loaded, video_path)
+            latencies.append(time.perf_counter() - start)
+            frames += timings.frames
+
+    return {
+        'model_load_s': model_load,
+        'classify_fps': frames / sum(latencies),
+        'latency_p50_s': float(np.percentile(latencies, 50)),
+        'latency_p90_s': float(np.percentile(latencies, 90)),
+        'latency_p99_s': float(np.percentile(latencies, 99)),
+    }
+
+
+def _sample_result(rng):
+    from results import ExamResult, KEYS
+    result = ExamResult("benchmark")
+    for key in KEYS:
+        result[key] = int(rng.integers(0, 5))
+    return result
+
+
+def bench_reports(directory, n_reports=50):
+    """ Measures the rendering of the HTML and PDF reports """
+    from utilities import render_report
+    from pdf_report import PdfReportRenderer
+
+    rng = np.random.default_rng(0)
+    reports = [(_sample_result(rng), "Name", "Surname", "1 Jan 1960", "17 Mar 2020",
+                "Pathological areas: <b>5/14</b>", ["1", "2", "3", "4", "4"], "Notes " * 20)
+               for _ in range(n_reports)]
+    template = os.path.join(RESOURCES, "report.html")
+
+    start = time.perf_counter()
+    for report in reports:
+        render_report(template, *report)
+    html_time = time.perf_counter() - start
+
+    renderer = PdfReportRenderer(template, os.path.join(RESOURCES, "logo_unitn.png"))
+    start = time.perf_counter()
+    for i, report in enumerate(reports):
+        renderer.render(os.path.join(directory, "report{}.pdf".format(i)), *report)
+    pdf_time = time.perf_counter() - start
+
+    return {'html_reports_per_s': n_reports / html_time, 'pdf_reports_per_s': n_reports / pdf_time}
+
+
+def bench_lung_map(n_patches=200):
+    """ Measures the patching of the classes of the areas in the lung map page """
+    from lung_map import apply_area_classes, AREA_IDS
+    with open(os.path.join(RESOURCES, "image_webView.html")) as file:
+        html = file.read()
+    colors = ["white", "yellow", "orange", "red", "grey"]
+
+    start = time.perf_counter()
+    for i in range(n_patches):
+        apply_area_classes(html, {area_id: colors[(i + j) % 5] for j, area_id in enumerate(AREA_IDS)})
+    return {'lung_map_patches_per_s': n_patches / (time.perf_counter() - start)}
+
+
+def find_ffmpeg():
+    """ The ffmpeg shipped in bin/ or the one in the PATH, None if there is none """
+    for name in ("ffmpeg", "ffmpeg.exe"):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin", name)
+        if os.path.exists(path):
+            return path
+    return shutil.which("ffmpeg")
+
+
+def bench_crop(directory, video_path):
+    """ Measures the export of a cropped video with the command used by the interface """
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        return {}
+    from ffmpeg_runner import FFMPEG_RUNNER
+    output = os.path.join(directory, "cropped.avi")
+    start = time.perf_counter()
+    FFMPEG_RUNNER.run([ffmpeg, '-y', '-i', video_path, '-filter:v', 'crop=256:256:10:10', '-crf', '15', output])
+    return {'ffmpeg_crop_s': time.perf_counter() - start}
+
+
+def run(args, directory):
+    videos = make_clips(directory, args.videos, args.frames, args.width, args.height)
+    model_path = make_model(os.path.join(directory, "model.hdf5"))
+
+    if args.engine == "tflite":
+        from tflite_classifier import TFLiteClassifier
+        classifier = functools.partial(TFLiteClassifier, model_path=model_path, quantization=args.quantization,
+                                       calibration_videos=videos, cache_path=None)
+    else:
+        from classifiers import TFClassifier
+        classifier = functools.partial(TFClassifier, model_path=model_path, cache_path=None)
+
+    metrics = {}
+    metrics.update(bench_classifier(classifier, videos, args.repeats))
+    metrics.update(bench_reports(directory, args.reports))
+    metrics.update(bench_lung_map())
+    metrics.update(bench_crop(directory, videos[0]))
+    metrics['peak_rss_mb'] = peak_rss_mb()
+
+    return {
+        'config': {key: value for key, value in vars(args).items() if key not in ("output", "compare", "workdir")},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'processor': platform.processor(), 'cpus': os.cpu_count()},
+        'metrics': metrics,
+    }
+
+
+def compare(previous, current, tolerance=0.1):
+    """
+    Compares the metrics of two runs.
+
+    :param tolerance: relative change allowed before a metric is flagged as a regression
+    :returns a list of (metric, previous value, current value, relative change, is a regression)
+    """
+    rows = []
+    for name, direction in METRICS.items():
+        before = previous['metrics'].get(name)
+        after = current['metrics'].get(name)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        worse = -change if direction == HIGHER_IS_BETTER else change
+        rows.append((name, before, after, change, worse > tolerance))
+    return rows
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks the scoring path on synthetic data")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="where the results are stored")
+    parser.add_argument("--compare", default=None, help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change flagged as a regression")
+    parser.add_argument("--videos", type=int, default=4, help="number of synthetic clips")
+    parser.add_argument("--frames", type=int, default=60, help="frames of each clip")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--repeats", type=int, default=3, help="times each clip is classified")
+    parser.add_argument("--reports", type=int, default=50, help="number of reports rendered")
+    parser.add_argument("--engine", choices=["tf", "tflite"], default="tf")
+    parser.add_argument("--quantization", choices=["none", "dynamic", "int8"], default="dynamic")
+    parser.add_argument("--workdir", default=None, help="where the synthetic data is written (default: a temporary directory)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.workdir is not None:
+        os.makedirs(args.workdir, exist_ok=True)
+        results = run(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            results = run(args, directory)
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    for name, value in results['metrics'].items():
+        print("{:<24} {:.4f}".format(name, value) if value is not None else "{:<24} -".format(name))
+
+    if args.compare is None:
+        return 0
+    with open(args.compare) as file:
+        previous = json.load(file)
+    n_regressions = 0
+    print("\nCompared with {}:".format(args.compare))
+    for name, before, after, change, regression in compare(previous, results, args.tolerance):
+        n_regressions += int(regression)
+        print("{:<24} {:>10.4f} -> {:>10.4f} {:+7.1%}{}".format(name, before, after, change,
+                                                                "  REGRESSION" if regression else ""))
+    return 1 if n_regressions > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
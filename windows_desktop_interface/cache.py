@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+"""
+This file contains the persistent cache of the inference results.
+
+The results are stored in a SQLite database, keyed by the content of the video, the
+crop applied to it, the model and the parameters used to sample the frames, so that
+re-opening a patient folder or re-cropping the same clip does not run the network again.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """ Returns the hex digest of the content of a file """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded, least-recently-used cache of the per-video outputs of the classifiers.
+
+    :param path: path of the SQLite database
+    :param max_bytes: maximum total size of the stored outputs
+    """
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Digests of the videos already hashed, keyed by (path, mtime, size)
+        self._digests = {}
+        # Model path -> digest of the model whose results are kept
+        self._retained_models = {}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            # Caches created before the path of the model was stored get the column now
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(results)")]
+            if "model_path" not in columns:
+                self._conn.execute("ALTER TABLE results ADD COLUMN model_path TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_model ON results (model)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_model_path ON results (model_path)")
+
+    def video_digest(self, video_path):
+        """ Returns the digest of a video, hashing it only if it changed since the last call """
+        stat = os.stat(video_path)
+        memo_key = (os.path.abspath(video_path), stat.st_mtime_ns, stat.st_size)
+        digest = self._digests.get(memo_key)
+        if digest is None:
+            digest = file_digest(video_path)
+            self._digests[memo_key] = digest
+        return digest
+
+    def key(self, video_path, model_digest, crop=None, sampling=None):
+        """
+        Builds the key of a result.
+
+        :param video_path: path of the video
+        :param model_digest: digest of the model file
+        :param crop: the crop rectangle [x, y, width, height] applied to the frames, if any
+        :param sampling: dictionary of the parameters used to sample the frames
+        """
+        parts = [self.video_digest(video_path), model_digest, crop, sampling or {}]
+        return hashlib.blake2b(json.dumps(parts, sort_keys=True).encode(), digest_size=20).hexdigest()
+
+    def get(self, key):
+        """ Returns the stored result, or None if missing """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, model_digest, value, model_path=None):
+        """
+        Stores a (JSON serializable) result and evicts the least recently used ones if needed
+
+        :param model_path: path of the model file, see retain_model
+        """
+        value = json.dumps(value)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, model, model_path, value, size, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_digest, model_path, value, len(value), time.time())
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM results ORDER BY last_access").fetchall()
+        to_remove = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            to_remove.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM results WHERE key = ?", to_remove)
+
+    def invalidate(self, model_digest=None):
+        """ Removes the results of a model, or all the results if model_digest is None """
+        with self._lock, self._conn:
+            if model_digest is None:
+                self._conn.execute("DELETE FROM results")
+            else:
+                self._conn.execute("DELETE FROM results WHERE model = ?", (model_digest,))
+
+    def retain_model(self, model_path, model_digest):
+        """
+        Removes the results of the previous versions of a model file, e.g. after model.hdf5 changed.
+        The results of the other models sharing the cache (e.g. the TFLite versions) are kept.
+        """
+        if self._retained_models.get(model_path) == model_digest:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM results WHERE model_path = ? AND model != ?", (model_path, model_digest))
+        self._retained_models[model_path] = model_digest
+
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def open_cache(path, max_bytes=64 * 1024 * 1024):
+    """ Returns the ResultCache stored in path, shared by the whole process """
+    path = os.path.abspath(path)
+    with _CACHES_LOCK:
+        if path not in _CACHES:
+            _CACHES[path] = ResultCache(path, max_bytes)
+        return _CACHES[path]
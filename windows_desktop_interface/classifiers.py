@@ -8,87 +8,341 @@ Date: 13/3/2020
 
 # Remove all the unused imports
 import os
-import cv2
 import json
+import functools
+import threading
 # import torch
 import numpy as np
-import tensorflow as tf
+from cache import file_digest, open_cache
+from crop_export import read_crop_sidecar
+from pipeline import FramePipeline, Cancelled
+from results import ExamResult, VideoResult
+from aggregate import ScoreAggregator, severity_probabilities
+from samplers import FirstFramesSampler
+from tracing import TRACER
 # from torchvision.models import resnet18
 
 
 class Classifier:
     """ Interface for the classifiers """
+    def classify(self, input_data, cancelled=None):
+        """
+        Classification function.
+
+        :param input_data: a dictionary which contains the needed parameters
+        :param cancelled: optional threading.Event; once set, the classification stops raising pipeline.Cancelled
+        :returns an ExamResult
+        """
+        raise NotImplementedError("This method must be implemented by the extending class")
+
     def predict(self, json_input):
         """
-        Predicition function.
+        Predicition function, the JSON version of classify.
 
         :param json_input: a json dictionary which contains the needed parameters
-        :returns a dictionary containing the same fields plus the ones regarding the results
+        :returns a json dictionary containing the results
         """
-        raise NotImplementedError("This method must be implemented by the extending class")
+        return self.classify(json.loads(json_input)).to_json()
 
 
-class TFClassifier(Classifier):
+class LoadedModel:
+    """ A model held by the registry, together with the lock that serializes its use """
+    def __init__(self, path, stamp, model, input_shape):
+        self.path = path
+        self.stamp = stamp
+        self.model = model
+        self.digest = file_digest(path)
+        self.lock = threading.Lock()
+        import tensorflow as tf
+        # Compiled forward pass with a fixed input signature, so that batches of any size
+        # reuse the same graph instead of going through the setup of model.predict
+        self.infer = tf.function(
+            lambda batch: model(batch, training=False),
+            input_signature=[tf.TensorSpec(shape=(None, *input_shape), dtype=tf.float32)]
+        )
+
+    def predict(self, batch):
+        """ Runs a forward pass on a batch of frames and returns the outputs as a numpy array """
+        batch = np.asarray(batch, dtype=np.float32)
+        with self.lock:
+            return self.infer(batch).numpy()
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of the loaded models.
+
+    Every model file is loaded and warmed up only once and then shared by all the
+    classifiers (and thus by all the Worker threads). If the file changes on disk,
+    the model is reloaded at the next request.
+    """
     def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, path, input_shape):
+        """
+        Returns the LoadedModel for the given file, loading it if needed.
+
+        :param path: path of the model file
+        :param input_shape: shape of a single input, used for the warm-up
+        """
+        path = os.path.abspath(path)
+        stamp = self._stamp(path)
+
+        with self._lock:
+            entry = self._models.get(path)
+            if entry is None or entry.stamp != stamp:
+                # TensorFlow takes seconds to initialize, it is imported with the first model
+                with TRACER.span("model_load", path=path):
+                    import tensorflow as tf
+                    model = tf.keras.models.load_model(path)
+                    entry = LoadedModel(path, stamp, model, input_shape)
+                    # Warm up the model with a dummy batch, so that the first real prediction
+                    # does not pay for the graph construction
+                    entry.predict(np.zeros((1, *input_shape), dtype=np.float32))
+                print("Model loaded: {}".format(path))
+                self._models[path] = entry
+            return entry
+
+    def is_loaded(self, path):
+        """ Returns True if the model stored in path is loaded and up to date, without loading it """
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._models.get(path)
+        return entry is not None and os.path.exists(path) and entry.stamp == self._stamp(path)
+
+    def reload(self, path, input_shape):
+        """ Forces the reload of a model, e.g. when it has been replaced on disk """
+        self.unload(path)
+        return self.get(path, input_shape)
+
+    def unload(self, path=None):
+        """ Unloads the model stored in path, or all the models if path is None """
+        with self._lock:
+            if path is None:
+                self._models.clear()
+                import tensorflow as tf
+                # Release the memory held by the Keras global state as well
+                tf.keras.backend.clear_session()
+            else:
+                self._models.pop(os.path.abspath(path), None)
+
+
+MODEL_REGISTRY = ModelRegistry()
+
+
+class VideoResults:
+    """
+    In-memory store of the outputs of the videos already classified in this process.
+
+    A stored output is reused only while both the video and the model are unchanged
+    on disk, so that re-running an exam only classifies the new or modified videos.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+
+    @staticmethod
+    def _key(video_path, loaded, crop):
+        stat = os.stat(video_path)
+        crop = tuple(crop) if crop is not None else None
+        return os.path.abspath(video_path), crop, stat.st_mtime_ns, stat.st_size, loaded.path, loaded.stamp
+
+    def get(self, video_path, loaded, crop=None):
+        with self._lock:
+            return self._results.get(self._key(video_path, loaded, crop))
+
+    def put(self, video_path, loaded, result, crop=None):
+        key = self._key(video_path, loaded, crop)
+        with self._lock:
+            # Drop the outputs of older versions of the same video and crop
+            for old_key in [k for k in self._results if k[:2] == key[:2]]:
+                del self._results[old_key]
+            self._results[key] = result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+VIDEO_RESULTS = VideoResults()
+
+
+class TFClassifier(Classifier):
+    def __init__(self, model_path="model.hdf5", batch_size=16, max_frames=16, cache_path="cache/results.sqlite", sampler=None):
+        """
+        :param model_path: path of the Keras model
+        :param batch_size: maximum number of frames that are sent to the model at once
+        :param max_frames: number of frames of each video that are classified by the default sampler
+        :param cache_path: path of the persistent result cache, None to disable it
+        :param sampler: the FrameSampler that chooses the frames to classify, by default the first max_frames
+        """
         # Load the default model
         self.img_shape = (224, 224, 3)
-        
-        self.model = tf.keras.models.load_model("model.hdf5")
-        print("Model loaded: {}".format(self.model))
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.sampler = sampler if sampler is not None else FirstFramesSampler(max_frames)
+        self.pipeline = FramePipeline(self.img_shape, self.batch_size, self.sampler)
+        self.cache = open_cache(cache_path) if cache_path is not None else None
+
+        self.warm_up()
+
+    def warm_up(self):
+        """ Loads and warms up the model, if needed. Returns the LoadedModel """
+        return self.load_model()
+
+    def load_model(self):
+        """ Returns the model used for the inference, see LoadedModel """
+        return MODEL_REGISTRY.get(self.model_path, self.img_shape)
+
+    def classify_video(self, loaded, video_path, crop=None, cancelled=None):
+        """
+        Classifies the frames of a video in batches, overlapping decoding and inference.
+
+        :param loaded: the LoadedModel used for the inference
+        :param video_path: path of the video
+        :param crop: optional rectangle [x, y, width, height] applied to the decoded frames
+        :param cancelled: optional threading.Event checked while the frames are decoded
+        :returns a tuple (sum of the outputs of the frames, StageTimings)
+        """
+        return self.pipeline.run(video_path, loaded.predict, crop, cancelled)
+
+    def sampling_params(self):
+        """ Parameters that affect which frames are classified, part of the cache key """
+        return self.sampler.params()
+
+    def cached_result(self, loaded, video_path, crop=None):
+        """ Returns the VideoResult stored in memory or in the persistent cache, None if the video must be classified """
+        probabilities = VIDEO_RESULTS.get(video_path, loaded, crop)
+        if probabilities is not None:
+            TRACER.count("memory_cache_hits")
+            return VideoResult(probabilities)
+
+        if self.cache is not None:
+            self.cache.retain_model(loaded.path, loaded.digest)
+            key = self.cache.key(video_path, loaded.digest, crop=crop, sampling=self.sampling_params())
+            result = VideoResult.from_dict(self.cache.get(key))
+            if result is not None:
+                TRACER.count("disk_cache_hits")
+                VIDEO_RESULTS.put(video_path, loaded, result.probabilities, crop)
+                return result
+
+        TRACER.count("cache_misses")
+        return None
+
+    def store_result(self, loaded, video_path, result, crop=None):
+        """ Stores the VideoResult of a video in memory and in the persistent cache """
+        VIDEO_RESULTS.put(video_path, loaded, result.probabilities, crop)
+        if self.cache is not None:
+            key = self.cache.key(video_path, loaded.digest, crop=crop, sampling=self.sampling_params())
+            self.cache.put(key, loaded.digest, result.to_dict(), loaded.path)
+
+    def classify_cached(self, loaded, video_path, crop=None, cancelled=None):
+        """
+        Classifies a video, reusing the in-memory or the persistent results when available.
+        A cancelled classification raises Cancelled and is not cached.
+
+        :returns a VideoResult, without timings if it was cached, or None if no frame was decoded
+        """
+        result = self.cached_result(loaded, video_path, crop)
+        if result is not None:
+            return result
+
+        clf_output, timings = self.classify_video(loaded, video_path, crop, cancelled)
+        if clf_output is None:
+            return None
+        result = VideoResult.from_output(clf_output, timings)
+        self.store_result(loaded, video_path, result, crop)
+        return result
+
+    @staticmethod
+    def list_videos(input_data):
+        """
+        Returns the videos to classify: the ones listed in 'video_files', the one in 'video_file'
+        or, as a fallback, all the .avi files contained in 'working_dir'
+        """
+        if 'video_files' in input_data:
+            return list(input_data['video_files'])
+        if 'video_file' in input_data:
+            return [input_data['video_file']]
+        working_dir = input_data['working_dir']
+        return [os.path.join(working_dir, file) for file in sorted(os.listdir(working_dir)) if file.lower().endswith(".avi")]
+
+    def classify_all(self, videos, crop, result, cancelled=None):
+        """
+        Classifies the videos, storing the VideoResult of each one in result.videos[file name].
+        Without a crop, the crop rectangle stored next to each video, if any, is applied.
+        """
+        # Fetch the model at every prediction, to pick up a model updated on disk
+        loaded = self.load_model()
+
+        for video_path in videos:
+            if cancelled is not None and cancelled.is_set():
+                raise Cancelled(video_path)
+            video_crop = crop if crop is not None else read_crop_sidecar(video_path)
+            video_result = self.classify_cached(loaded, video_path, video_crop, cancelled)
+            if video_result is not None:
+                result.videos[os.path.basename(video_path)] = video_result
+
+    def classify(self, input_data, cancelled=None):
+        """
+        Classifies the videos listed in input_data (see list_videos). The area shown by a video is
+        given by 'area' together with 'video_file', or by 'areas', a dictionary mapping file names
+        to areas: only these areas are scored, the others are left NOT_MEASURED.
+        """
+        videos = self.list_videos(input_data)
+        working_dir = input_data.get('working_dir')
+        if working_dir is None:
+            working_dir = os.path.dirname(os.path.abspath(videos[0])) if videos else ""
+        result = ExamResult(working_dir.split("/")[-1], working_dir)
+
+        # Optional crop rectangle [x, y, width, height], applied in memory to the decoded frames;
+        # see crop_export for the crop rectangles stored next to the videos
+        with TRACER.span("classify_all", videos=len(videos)):
+            self.classify_all(videos, input_data.get('crop'), result, cancelled)
+
+        # Optional mapping from the file name of a video to the area it shows
+        areas = input_data.get('areas', {})
+        if 'video_file' in input_data and 'area' in input_data:
+            areas = {os.path.basename(input_data['video_file']): input_data['area']}
+
+        # The source of each score is recorded, the results may arrive after the interface moved on
+        paths = {os.path.basename(video_path): video_path for video_path in videos}
+        aggregator = ScoreAggregator()
+        for file, area in areas.items():
+            if file in result.videos:
+                aggregator.update_row(area, severity_probabilities(result.videos[file].probabilities))
+                crop = input_data.get('crop')
+                result.sources[area] = (paths[file], crop if crop is not None else read_crop_sidecar(paths[file]))
+        return aggregator.apply(result)
 
-    def predict(self, json_input):
-        input_data = json.loads(json_input)
-        output = input_data
-        
-        for file in os.listdir(input_data['working_dir']):
-            if ".avi" in file:
-                cap = cv2.VideoCapture(os.path.join(input_data['working_dir'], file))
-
-                clf_output = np.zeros((1, 1000))
-                ctr = 0
-                max_ = 16
-                while cap.isOpened():
-                    _, frame = cap.read()
-
-                    if frame is None or len(frame) == 0:
-                        break
-                    frame = cv2.resize(frame, (self.img_shape[1], self.img_shape[0]))
-                    curr_output = self.model.predict(frame.reshape(-1, *self.img_shape))
-                    clf_output += curr_output.reshape((1, 1000))
-
-                    ctr += 1
-                    #print("Analizzato frame {} di {}".format(ctr, max_))
-                    if ctr == max_:
-                        break
-
-                output[file] = str(np.argmax(clf_output))
-        output['name'] = output['working_dir'].split("/")[-1]
-
-        output.update(
-            {
-                'left-anterior-apical': 0,
-                'left-anterior-basal': 1,
-                'left-lateral-apical': 2,
-                'left-lateral-basal': 3,
-                'left-posterior-apical': 4,
-                'left-posterior-medial': 0,
-                'left-posterior-basal': 1,
-                'right-anterior-apical': 2,
-                'right-anterior-basal': 3,
-                'right-lateral-apical': 4,
-                'right-lateral-basal': 0,
-                'right-posterior-apical': 1,
-                'right-posterior-medial': 2,
-                'right-posterior-basal': 3,
-                'pathological_areas': 4,
-                'n_score_0': 4,
-                'n_score_1': 3,
-                'n_score_2': 2,
-                'n_score_3': 1,
-                'n_not_measured': 10,
-            }
-        )
 
-        output = json.dumps(output)
-        return output
+def classifier_from_config(config_path):
+    """
+    Returns a callable creating the classifier selected in a JSON configuration file, e.g.
+    {"backend": "tflite", "quantization": "int8", "calibration_videos": ["exam/clip0.avi"]}
+    or {"backend": "process", "n_workers": 4}. The other fields are passed to the constructor. TFClassifier is used if the file does not exist.
+    """
+    if not os.path.exists(config_path):
+        return TFClassifier
+    with open(config_path) as file:
+        config = json.load(file)
 
+    backend = config.pop('backend', "tf")
+    if backend == "tf":
+        classifier = TFClassifier
+    elif backend == "tflite":
+        from tflite_classifier import TFLiteClassifier
+        classifier = TFLiteClassifier
+    elif backend == "process":
+        from process_pool import ProcessPoolClassifier
+        classifier = ProcessPoolClassifier
+    else:
+        raise ValueError("Unknown backend {}, expected tf, tflite or process".format(backend))
+    return functools.partial(classifier, **config)
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+"""
+This file contains the modes of export of the cropped videos.
+
+Besides re-encoding the cropped video, the crop rectangle can be stored as metadata only:
+the original file is kept and the rectangle is written to a sidecar JSON file next to it
+(e.g. video.avi -> video.avi.crop.json), which the classifiers apply when they decode the
+frames. The expected cost of each mode is estimated from the duration of the clip.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import os
+import json
+
+
+class CropMode:
+    """
+    A mode of export of the cropped video.
+
+    :param label: name shown in the interface
+    :param encoder: ffmpeg arguments of the encoder, None if no video is encoded
+    :param extension: extension of the exported video, None to keep the one of the original
+    :param seconds_per_second: approximate encoding time per second of video, on a recent workstation
+    :param size: approximate size of the exported video compared with the default encode
+    """
+    def __init__(self, label, encoder, extension=None, seconds_per_second=0.0, size=1.0):
+        self.label = label
+        self.encoder = encoder
+        self.extension = extension
+        self.seconds_per_second = seconds_per_second
+        self.size = size
+
+    def expected_cost(self, duration):
+        """ Returns a short description of the expected time and size for a clip of duration seconds """
+        if self.encoder is None:
+            return "instant, no video is encoded"
+        seconds = self.seconds_per_second * duration
+        time = "~{:.0f}s".format(seconds) if seconds >= 1 else "under 1s"
+        return "{} of encoding, ~{:g}x the size of the default export".format(time, self.size)
+
+
+NONE = "none"
+METADATA = "metadata"
+FAST = "fast"
+QUALITY = "quality"
+LOSSLESS = "lossless"
+
+CROP_MODES = {
+    NONE: CropMode("Do not save the crop", None),
+    METADATA: CropMode("Save the crop rectangle only", None),
+    # -crf 15 is the quality of the exported video, see the ffmpeg documentation
+    FAST: CropMode("Save cropped video (fast)", ['-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '15'],
+                   seconds_per_second=0.1, size=2.5),
+    QUALITY: CropMode("Save cropped video (quality)", ['-c:v', 'libx264', '-crf', '15'],
+                      seconds_per_second=0.5, size=1.0),
+    # Every frame is a key frame and is stored without loss, for the archive
+    LOSSLESS: CropMode("Save cropped video (lossless, archival)", ['-c:v', 'ffv1', '-level', '3', '-g', '1'],
+                       extension=".avi", seconds_per_second=0.3, size=20.0),
+}
+
+
+def crop_command(ffmpeg_bin, video_path, crop, mode):
+    """
+    Returns (the ffmpeg command exporting the cropped video, the path of the exported video)
+
+    :param crop: rectangle [x, y, width, height] in pixels
+    :param mode: key of a mode of CROP_MODES that encodes a video
+    """
+    mode = CROP_MODES[mode]
+    pre, ext = os.path.splitext(video_path)
+    output = pre + "_cropped" + (mode.extension or ext)
+    x, y, width, height = crop
+    command = [ffmpeg_bin, '-y', '-i', video_path, '-filter:v', 'crop={}:{}:{}:{}'.format(width, height, x, y)]
+    return command + mode.encoder + [output], output
+
+
+def sidecar_path(video_path):
+    return video_path + ".crop.json"
+
+
+def write_crop_sidecar(video_path, crop):
+    """ Stores the crop rectangle of a video next to it, together with the size of the video """
+    with open(sidecar_path(video_path), "w") as file:
+        json.dump({'crop': [int(value) for value in crop], 'video_size': os.path.getsize(video_path)}, file)
+
+
+def read_crop_sidecar(video_path):
+    """ Returns the crop rectangle stored next to a video, or None if there is none or the video changed """
+    try:
+        with open(sidecar_path(video_path)) as file:
+            content = json.load(file)
+        if content['video_size'] != os.path.getsize(video_path):
+            return None
+        return list(content['crop'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
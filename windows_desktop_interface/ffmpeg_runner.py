@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+"""
+This file contains the runner of the ffmpeg commands used by the interface.
+
+The progress of ffmpeg is read from "-progress pipe:1" and reported through a callback,
+the exit code is checked and the end of stderr is kept for the error messages. A command
+that runs longer than its timeout, or that is cancelled, is terminated. The number of
+commands running at the same time is limited, since every encode already uses several cores.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import os
+import re
+import time
+import threading
+import subprocess
+import collections
+from pipeline import Cancelled
+from tracing import TRACER
+
+
+# Every x264 encode is multi-threaded already
+MAX_PARALLEL_ENCODES = max(1, (os.cpu_count() or 1) // 4)
+
+# Duration of the input, printed by ffmpeg on stderr, e.g. "Duration: 00:00:05.04"
+_DURATION = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+class FFmpegError(Exception):
+    """ ffmpeg exited with an error; the message contains the end of its stderr """
+    def __init__(self, message, returncode=None, stderr=""):
+        super(FFmpegError, self).__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class FFmpegTimeout(FFmpegError):
+    """ ffmpeg was terminated because it exceeded its timeout """
+
+
+class FFmpegRunner:
+    """
+    Runs ffmpeg commands, at most max_parallel at the same time; the others wait for their turn.
+
+    :param max_parallel: maximum number of commands running at the same time
+    :param stderr_lines: number of lines at the end of stderr kept for the diagnostics
+    """
+    def __init__(self, max_parallel=MAX_PARALLEL_ENCODES, stderr_lines=50):
+        self._slots = threading.BoundedSemaphore(max_parallel)
+        self.stderr_lines = stderr_lines
+
+    def run(self, command, progress=None, timeout=None, cancelled=None):
+        """
+        Runs an ffmpeg command and waits for it.
+
+        :param command: the command as a list, starting with the ffmpeg executable
+        :param progress: optional function called with (processed, total) milliseconds of the input;
+            total is 0 while the duration is unknown. It is called from a background thread
+        :param timeout: maximum wall-clock time in seconds, excluding the wait for a free slot
+        :param cancelled: optional threading.Event; once set, ffmpeg is terminated and Cancelled is raised
+        :returns the end of stderr
+        """
+        # The progress goes to stdout as key=value lines, the usual statistics are not needed
+        command = [command[0], '-nostdin', '-nostats', '-progress', 'pipe:1'] + list(command[1:])
+        with self._slots:
+            if cancelled is not None and cancelled.is_set():
+                raise Cancelled(command[0])
+            with TRACER.span("ffmpeg", command=os.path.basename(command[-1])):
+                return self._run(command, progress, timeout, cancelled)
+
+    def _run(self, command, progress, timeout, cancelled):
+        stderr = collections.deque(maxlen=self.stderr_lines)
+        duration = [0]  # milliseconds, set by the stderr reader
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   universal_newlines=True, errors="replace")
+        readers = [
+            threading.Thread(target=self._read_stderr, args=(process.stderr, stderr, duration), daemon=True),
+            threading.Thread(target=self._read_progress, args=(process.stdout, progress, duration), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        try:
+            while True:
+                try:
+                    returncode = process.wait(0.1)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if cancelled is not None and cancelled.is_set():
+                    raise Cancelled(command[-1])
+                if deadline is not None and time.monotonic() > deadline:
+                    raise FFmpegTimeout("ffmpeg exceeded the timeout of {}s".format(timeout), None, "\n".join(stderr))
+        finally:
+            if process.poll() is None:
+                self._terminate(process)
+            for reader in readers:
+                reader.join(1)
+
+        stderr = "\n".join(stderr)
+        if returncode != 0:
+            last_line = stderr.strip().splitlines()[-1] if stderr.strip() else ""
+            raise FFmpegError("ffmpeg exited with code {}: {}".format(returncode, last_line), returncode, stderr)
+        return stderr
+
+    @staticmethod
+    def _terminate(process):
+        process.terminate()
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    @staticmethod
+    def _read_stderr(stream, lines, duration):
+        for line in stream:
+            line = line.rstrip()
+            lines.append(line)
+            match = _DURATION.search(line)
+            if match is not None and duration[0] == 0:
+                hours, minutes, seconds = match.groups()
+                duration[0] = int((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1000)
+
+    @staticmethod
+    def _read_progress(stream, progress, duration):
+        for line in stream:
+            key, _, value = line.strip().partition("=")
+            if progress is None:
+                continue
+            # out_time_ms is in microseconds, despite its name; unlike out_time_us it exists in every version
+            if key == "out_time_ms" and value.isdigit():
+                progress(int(value) // 1000, duration[0])
+            elif key == "progress" and value == "end" and duration[0] > 0:
+                progress(duration[0], duration[0])
+
+
+FFMPEG_RUNNER = FFmpegRunner()
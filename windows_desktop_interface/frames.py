@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+"""
+This file contains the in-process extraction of the frames shown in the interface, and the
+scrubber of the crop window: a decoder that stays open, a memory-bounded LRU cache of the
+frames scaled for the display and a background thread that decodes the requested frame and
+reads the following ones ahead.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import threading
+import collections
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtGui import QImage
+from tracing import TRACER
+
+
+class FrameGrabber:
+    """
+    Decodes single frames of a video in-process. The decoder stays open between the
+    calls, so that following frames of the same video can be read without reopening it.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cap = None
+        self._next_index = 0
+        self.path = None
+        self.frame_count = 0
+        self.fps = 0.0
+        self.width = 0
+        self.height = 0
+
+    def open(self, path):
+        """ Opens a video, releasing the previous one. Returns False if it cannot be decoded """
+        # OpenCV is imported at the first video, not when the application starts
+        import cv2
+        with self._lock:
+            self._release()
+            cap = cv2.VideoCapture(path)
+            if not cap.isOpened():
+                return False
+            self._cap = cap
+            self._next_index = 0
+            self.path = path
+            self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.fps = cap.get(cv2.CAP_PROP_FPS)
+            self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            return True
+
+    def grab(self, index=0):
+        """ Returns the frame at the given index as a BGR numpy array, or None if it cannot be read """
+        import cv2
+        with self._lock:
+            if self._cap is None:
+                return None
+            # Seeking is needed only when the frame is not the next one of the decoder
+            if index != self._next_index:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ok, frame = self._cap.read()
+            if not ok or frame is None:
+                self._next_index = -1
+                return None
+            self._next_index = index + 1
+            return frame
+
+    def close(self):
+        with self._lock:
+            self._release()
+
+    def _release(self):
+        if self._cap is not None:
+            self._cap.release()
+        self._cap = None
+        self.path = None
+
+
+def frame_to_qimage(frame):
+    """
+    Wraps a BGR frame into a QImage without copying its pixels. The QImage keeps a
+    reference to the frame, which must not be modified while the image is in use.
+    """
+    height, width = frame.shape[:2]
+    image = QImage(frame.data, width, height, frame.strides[0], QImage.Format_BGR888)
+    image.frame = frame
+    return image
+
+
+class FrameCache:
+    """
+    LRU cache of images bounded by the memory they use.
+
+    :param max_bytes: maximum size of the cached images, the least recently used are dropped
+    """
+    def __init__(self, max_bytes=64 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._lock = threading.Lock()
+        self._images = collections.OrderedDict()  # index -> QImage
+
+    def get(self, index):
+        with self._lock:
+            image = self._images.get(index)
+            if image is not None:
+                self._images.move_to_end(index)
+            return image
+
+    def __contains__(self, index):
+        with self._lock:
+            return index in self._images
+
+    def put(self, index, image):
+        with self._lock:
+            if index in self._images:
+                self.size -= self._images.pop(index).frame.nbytes
+            self._images[index] = image
+            self.size += image.frame.nbytes
+            while self.size > self.max_bytes and len(self._images) > 1:
+                _, dropped = self._images.popitem(last=False)
+                self.size -= dropped.frame.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.size = 0
+
+
+class FrameScrubber(QObject):
+    """
+    Shows any frame of a video while a slider is moved. The frames are scaled to fit max_side
+    and cached; a frame that is not cached is decoded in a background thread, together with
+    the read_ahead frames that follow it, and delivered through frame_ready.
+
+    :param grabber: the FrameGrabber of the video
+    :param max_bytes: memory used by the cached frames
+    :param read_ahead: number of frames decoded after the requested one
+    :param max_side: maximum width and height of the displayed frames
+    """
+    frame_ready = pyqtSignal(int, object)  # index, QImage
+
+    def __init__(self, grabber, max_bytes=64 * 2 ** 20, read_ahead=8, max_side=1280, parent=None):
+        super(FrameScrubber, self).__init__(parent)
+        self.grabber = grabber
+        self.cache = FrameCache(max_bytes)
+        self.read_ahead = read_ahead
+        self.max_side = max_side
+        self.display_size = (0, 0)
+        self._condition = threading.Condition()
+        self._wanted = None
+        self._generation = 0  # incremented when another video is opened
+        self._thread = None
+        self._closed = False
+
+    def open(self, path):
+        """ Opens a video and drops the frames of the previous one. Returns False if it cannot be decoded """
+        with self._condition:
+            self._generation += 1
+            self._wanted = None
+            self.cache.clear()
+            if not self.grabber.open(path):
+                return False
+            scale = min(1.0, self.max_side / max(self.grabber.width, self.grabber.height, 1))
+            self.display_size = (max(1, int(self.grabber.width * scale)), max(1, int(self.grabber.height * scale)))
+        return True
+
+    def frame(self, index):
+        """ Returns the QImage of a frame, decoding it in the calling thread if needed; None if it cannot be read """
+        image = self.cache.get(index)
+        if image is None:
+            image = self._decode(index, self._generation)
+        return image
+
+    def request(self, index):
+        """
+        Returns the QImage of a frame if it is cached; otherwise returns None and the frame is
+        decoded in background and emitted through frame_ready. Only the latest request is served.
+        """
+        image = self.cache.get(index)
+        if image is not None:
+            TRACER.count("scrub_cache_hits")
+            return image
+        TRACER.count("scrub_cache_misses")
+        with self._condition:
+            self._wanted = index
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return None
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self.grabber.close()
+        self.cache.clear()
+
+    def _decode(self, index, generation):
+        import cv2
+        frame = self.grabber.grab(index)
+        if frame is None:
+            return None
+        image = frame_to_qimage(cv2.resize(frame, self.display_size, interpolation=cv2.INTER_AREA))
+        # The video may have been changed while the frame was decoded
+        if generation == self._generation:
+            self.cache.put(index, image)
+        return image
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._wanted is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                index, self._wanted = self._wanted, None
+                generation = self._generation
+
+            with TRACER.span("scrub_decode"):
+                image = self.cache.get(index)
+                if image is None:
+                    image = self._decode(index, generation)
+            if image is not None and generation == self._generation:
+                self.frame_ready.emit(index, image)
+
+            # The next frames are read sequentially, without seeking, until another frame is requested
+            for ahead in range(index + 1, min(index + 1 + self.read_ahead, self.grabber.frame_count)):
+                if self._wanted is not None or self._closed or generation != self._generation:
+                    break
+                if ahead not in self.cache and self._decode(ahead, generation) is None:
+                    break
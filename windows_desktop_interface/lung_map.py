@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+"""
+This file contains the model of the lung map shown in the web view.
+
+The color of the 14 areas is kept in memory and only the area that changed is pushed
+into the loaded page through JavaScript, without rewriting and reloading the page.
+Saving the customized page on disk is optional and debounced.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import os
+import re
+import json
+from PyQt5.QtCore import QObject, QTimer
+from utilities import KEYS, export_html
+from tracing import TRACER
+
+
+DEFAULT_CLASS = "grey"
+AREA_IDS = ["_" + key for key in KEYS]
+
+_PATH_TAG = r'<path\b[^>]*\bid="{}"[^>]*>'
+_CLASS_ATTRIBUTE = re.compile(r'class="[^"]*"')
+
+
+def apply_area_classes(html, classes):
+    """
+    Returns the html with the CSS class of the given areas replaced.
+
+    :param html: source of the lung map page
+    :param classes: dictionary mapping the id of an area (e.g. "_left-anterior-apical") to its CSS class
+    """
+    for area_id, css_class in classes.items():
+        replacement = 'class="{}"'.format(css_class)
+        html = re.sub(_PATH_TAG.format(re.escape(area_id)),
+                      lambda match: _CLASS_ATTRIBUTE.sub(replacement, match.group(0), count=1),
+                      html, count=1)
+    return html
+
+
+class LungMap(QObject):
+    """
+    Keeps the state of the areas of the lung map and mirrors it into a QWebEnginePage.
+
+    :param page: the QWebEnginePage showing the lung map template
+    :param template_path: path of the template page
+    :param persist_path: where the customized page is saved, None to keep the state in memory only
+    :param debounce_ms: delay after the last change before the customized page is saved
+    """
+    def __init__(self, page, template_path, persist_path=None, debounce_ms=1000, parent=None):
+        super(LungMap, self).__init__(parent)
+        self.page = page
+        self.template_path = template_path
+        self.persist_path = persist_path
+        self.classes = dict.fromkeys(AREA_IDS, DEFAULT_CLASS)
+
+        self._persist_timer = QTimer(self)
+        self._persist_timer.setSingleShot(True)
+        self._persist_timer.setInterval(debounce_ms)
+        self._persist_timer.timeout.connect(self.persist)
+
+        # Push the whole state again if the page gets reloaded
+        self.page.loadFinished.connect(self._on_load_finished)
+
+    def set_area(self, area_id, css_class):
+        """ Changes the CSS class of an area, only that area is updated in the page """
+        if area_id not in self.classes:
+            raise KeyError("Unknown area {}".format(area_id))
+        if self.classes[area_id] == css_class:
+            return
+        self.classes[area_id] = css_class
+        self._push({area_id: css_class})
+        self._schedule_persist()
+
+    def reset(self):
+        """ Sets all the areas back to the default class """
+        changed = {area_id: DEFAULT_CLASS for area_id, css_class in self.classes.items() if css_class != DEFAULT_CLASS}
+        self.classes = dict.fromkeys(AREA_IDS, DEFAULT_CLASS)
+        self._persist_timer.stop()
+        if changed:
+            self._push(changed)
+
+    def _push(self, classes):
+        script = (
+            "(function(classes) {"
+            "  for (var id in classes) {"
+            "    var area = document.getElementById(id);"
+            "    if (area) { area.setAttribute('class', classes[id]); }"
+            "  }"
+            "})(" + json.dumps(classes) + ");"
+        )
+        with TRACER.span("html_patch", areas=len(classes)):
+            self.page.runJavaScript(script)
+
+    def _on_load_finished(self, ok):
+        TRACER.count("page_reloads")
+        changed = {area_id: css_class for area_id, css_class in self.classes.items() if css_class != DEFAULT_CLASS}
+        if ok and changed:
+            self._push(changed)
+
+    def _schedule_persist(self):
+        if self.persist_path is not None:
+            self._persist_timer.start()
+
+    def persist(self):
+        """ Saves the customized page on disk """
+        if self.persist_path is None:
+            return
+        with TRACER.span("page_persist"):
+            with open(self.template_path) as file:
+                html = file.read()
+            html = apply_area_classes(html, self.classes)
+            # The links of the saved page must point to the page itself
+            html = html.replace(os.path.basename(self.template_path), os.path.basename(self.persist_path))
+            export_html(html, self.persist_path)
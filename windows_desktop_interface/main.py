@@ -7,23 +7,34 @@ Copyright: University of Trento
 
 Date: 13/3/2020
 """
-import os, shutil
+import os
 import sys
 import time
-import json
-import threading
+# startup time, measured from here to the first iteration of the event loop
+STARTED = time.perf_counter()
+STARTUP_TARGET = 1.5 # seconds
 import traceback
-import subprocess
-import re
+import multiprocessing
+import numpy as np
 import urllib.parse as urlparse
 from pathlib import Path
 from urllib.parse import parse_qs
-from reportlab.pdfgen import canvas
-from classifiers import TFClassifier
-from utilities import customize_report, export_pdf, export_html, generate_output_html, Calendar, ClickableQLabel
-from PyQt5.QtWidgets import QApplication, QSizePolicy, QWidget, QVBoxLayout, QPushButton, QFileDialog, QLabel, QDialog, QGridLayout, QFrame, QLineEdit, QTextEdit, QRubberBand, QMessageBox, QMainWindow, QSizeGrip, QHBoxLayout
-from PyQt5.QtGui import QIcon, QPixmap, QMovie, QCursor, QPainter
-from PyQt5.QtCore import pyqtSlot, QThreadPool, QRunnable, QObject, pyqtSignal, Qt, QSize, QPoint, QRect, QUrl
+from classifiers import classifier_from_config
+from pipeline import Cancelled, InvalidCrop
+from frames import FrameGrabber, FrameScrubber
+from lung_map import LungMap
+from pdf_report import PdfReportRenderer
+from results import KEYS, KEY_INDEX, N_SEVERITIES, ExamResult, NOT_MEASURED
+from aggregate import ScoreAggregator
+from store import PatientStore
+from ffmpeg_runner import FFMPEG_RUNNER, FFmpegError, MAX_PARALLEL_ENCODES
+from crop_export import CROP_MODES, NONE, METADATA, crop_command, write_crop_sidecar
+from scheduler import JobScheduler, Job, CPU, FFMPEG, INTERACTIVE, BACKGROUND
+from tracing import TRACER, traced
+from utilities import render_report, export_html, Calendar, DateLabel
+from PyQt5.QtWidgets import QApplication, QSizePolicy, QWidget, QVBoxLayout, QPushButton, QFileDialog, QLabel, QDialog, QGridLayout, QFrame, QLineEdit, QTextEdit, QRubberBand, QMessageBox, QMainWindow, QSizeGrip, QHBoxLayout, QCheckBox, QShortcut, QComboBox, QSlider, QListWidget, QListWidgetItem
+from PyQt5.QtGui import QIcon, QPixmap, QMovie, QCursor, QPainter, QKeySequence
+from PyQt5.QtCore import pyqtSlot, QTimer, QObject, pyqtSignal, Qt, QSize, QPoint, QUrl
 from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEnginePage
 
 
@@ -112,7 +123,6 @@ class ClickableWebPage(QWebEnginePage):
 
     @pyqtSlot()
     def acceptNavigationRequest(self, url, type, isMainFrame):
-        result = super(ClickableWebPage,self).acceptNavigationRequest(url, type, isMainFrame)
         #print("Clicked url: "+ url.toString())
         parsed = urlparse.urlparse(url.toString())
         valsDict = parse_qs(parsed.query)
@@ -120,8 +130,10 @@ class ClickableWebPage(QWebEnginePage):
             id = valsDict['id'][0]
             self.signals.id.emit(id)
             #print("Clicked area "+id)
+            # Stay on the current page, the colors of the areas live in it
+            return False
 
-        return result
+        return super(ClickableWebPage,self).acceptNavigationRequest(url, type, isMainFrame)
 
 
 class VideoCropWindow(QMainWindow):
@@ -141,7 +153,9 @@ class AreaSignals(QObject):
 
 
 class WorkerSignals(QObject):
-    result = pyqtSignal(str)
+    result = pyqtSignal(object)
+    progress = pyqtSignal(int, int)  # done, total
+    error = pyqtSignal(str)
 
 
 class VideoView(QLabel):
@@ -160,57 +174,279 @@ class VideoView(QLabel):
         self.rubberBand.show()
 
 
-class Worker(QRunnable):
+class Worker(Job):
     '''
     Worker thread, used for the parallelization
     '''
-    def __init__(self, dir_path, classifier):
+    def __init__(self, input_, classifier):
+        """
+        :param input_: the input of the classifier, e.g. {'working_dir': ...} or {'video_file': ...}
+        :param classifier: the class of the classifier
+        """
         super(Worker, self).__init__()
-        self.dir_path = dir_path
+        self.input_ = input_
         self.signals = WorkerSignals()
-        self.classifier = classifier()
+        self.classifier = classifier
 
-    @pyqtSlot()
-    def run(self):
+    def execute(self):
         """ Runs the thread """
-        input_ = {'working_dir': self.dir_path}
+        try:
+            # the classifier is created here, so that its model is never loaded by the GUI thread
+            result = self.classifier().classify(self.input_, self.cancelled)
+            self.signals.result.emit(result)  # Return the ExamResult of the processing
+        except Cancelled:
+            # Superseded by a newer job, nothing to report
+            pass
+        except InvalidCrop as e:
+            self.signals.result.emit(ExamResult.failed(str(e)))
+        except:
+            traceback.print_exc()
+            self.signals.result.emit(ExamResult.failed(traceback.format_exc()))
+
+
+class WarmupWorker(Job):
+    '''
+    Loads and warms up the model of a classifier in background
+    '''
+    def __init__(self, classifier):
+        """
+        :param classifier: the class of the classifier
+        """
+        super(WarmupWorker, self).__init__()
+        self.classifier = classifier
+        self.signals = WorkerSignals()
 
+    def execute(self):
+        """ Runs the thread, emits the time taken to load the model """
+        start = time.perf_counter()
         try:
-            result = self.classifier.predict(json.dumps(input_))
-            self.signals.result.emit(result)  # Return the result of the processing
+            self.classifier()
+            self.signals.result.emit(time.perf_counter() - start)
         except:
             traceback.print_exc()
             exctype, value = sys.exc_info()[:2]
-            self.signals.result.emit(json.dumps({'exception type': str(exctype), 'value': str(value), 'traceback': str(traceback.format_exc())}))
+            self.signals.error.emit(str(value))
 
 
-class VideoWorker(QRunnable):
+class VideoWorker(Job):
     '''
-    Worker thread, used for the parallelization
+    Worker thread, runs an ffmpeg command and reports its progress in milliseconds of video
     '''
-    def __init__(self, commandStringList, successMessage, failureMessage):
+    def __init__(self, commandStringList, successMessage, failureMessage, timeout=600):
+        """
+        :param timeout: seconds after which ffmpeg is terminated
+        """
         super(VideoWorker, self).__init__()
         self.commandStringList = commandStringList
         self.signals = WorkerSignals()
         self.failureMessage = failureMessage
         self.successMessage = successMessage
+        self.timeout = timeout
 
-    @pyqtSlot()
-    def run(self):
+    def execute(self):
         """ Runs the thread """
         try:
-            subprocess.call(self.commandStringList)
-            self.signals.result.emit(json.dumps({'value': self.successMessage}))
+            FFMPEG_RUNNER.run(self.commandStringList, self.signals.progress.emit, self.timeout, self.cancelled)
+            self.signals.result.emit(self.successMessage)
+        except Cancelled:
+            # Superseded by a newer export, nothing to report
+            pass
+        except FFmpegError as e:
+            print(e.stderr)
+            self.signals.result.emit("{}: {}".format(self.failureMessage, e))
         except:
             traceback.print_exc()
             exctype, value = sys.exc_info()[:2]
-            #print(str(exctype))
-            #print(str(value))
-            self.signals.result.emit(json.dumps({'value': self.failureMessage}))
+            self.signals.result.emit("{}: {}".format(self.failureMessage, value))
+
+
+class ReportJob:
+    """ Everything needed to export the report of a patient """
+    def __init__(self, output_dir, result, name, surname, dob, doa, pathological_areas, totals, notes):
+        self.output_dir = output_dir
+        self.result = result
+        self.name = name
+        self.surname = surname
+        self.dob = dob
+        self.doa = doa
+        self.pathological_areas = pathological_areas
+        self.totals = totals
+        self.notes = notes
+
+    def export(self):
+        """ Writes the HTML and the PDF report """
+        with TRACER.span("report_html"):
+            html = render_report("resources/report.html", self.result, self.name, self.surname, self.dob,
+                    self.doa, self.pathological_areas, self.totals, self.notes)
+            export_html(html, os.path.join(self.output_dir, "Report.html"))
+        # The PDF is drawn in-process, without going through wkhtmltopdf
+        with TRACER.span("pdf_export"):
+            PdfReportRenderer().render(os.path.join(self.output_dir, "{}{}_{}_{}.pdf".format(self.surname, self.name, self.dob, self.doa)),
+                    self.result, self.name, self.surname, self.dob, self.doa, self.pathological_areas, self.totals, self.notes)
+
+
+class ReportWorker(Job):
+    '''
+    Worker thread, exports a single report
+    '''
+    def __init__(self, job):
+        super(ReportWorker, self).__init__()
+        self.job = job
+        self.signals = WorkerSignals()
+
+    def execute(self):
+        """ Runs the thread """
+        try:
+            self.job.export()
+            self.signals.result.emit('success')
+        except:
+            traceback.print_exc()
+            exctype, value = sys.exc_info()[:2]
+            self.signals.error.emit("{} {}: {}".format(self.job.surname, self.job.name, value))
+
+
+class ReportExportQueue(QObject):
+    '''
+    Exports the reports as background jobs of the scheduler, behind the classification of the videos,
+    so that the interface stays responsive. The progress of the queued reports and the failures are
+    reported through signals.
+    '''
+    def __init__(self, scheduler, parent=None):
+        super(ReportExportQueue, self).__init__(parent)
+        self.signals = WorkerSignals()
+        self.scheduler = scheduler
+        self._pending = []
+        self._done = 0
+        self._total = 0
+
+    def submit(self, jobs):
+        """ Queues a list of ReportJob """
+        for job in jobs:
+            worker = ReportWorker(job)
+            # finished is emitted once per job, also when it is cancelled before starting
+            worker.job_signals.finished.connect(self._job_finished)
+            worker.signals.error.connect(self.signals.error)
+            self._pending.append(worker)
+            self._total += 1
+            self.scheduler.submit(worker, CPU, BACKGROUND)
+        self.signals.progress.emit(self._done, self._total)
+
+    def cancel(self):
+        """ Drops the reports not started yet; the ones being exported are completed """
+        for worker in self._pending[:]:
+            self.scheduler.cancel_job(worker)
+
+    def _job_finished(self, worker):
+        if worker not in self._pending:
+            return
+        self._pending.remove(worker)
+        self._done += 1
+        self.signals.progress.emit(self._done, self._total)
+        if len(self._pending) == 0:
+            self._done = self._total = 0
+            self.signals.result.emit('success')
+
+
+class ExamSearchDialog(QDialog):
+    '''
+    Searches the exams of the store by the name of the patient; the chosen exam is in exam_id once accepted
+    '''
+    def __init__(self, store, parent=None):
+        super(ExamSearchDialog, self).__init__(parent)
+        self.setWindowTitle("Open exam")
+        self.store = store
+        self.exam_id = None
+        layout = QVBoxLayout()
+
+        self.surname = QLineEdit()
+        self.surname.setPlaceholderText("Last name")
+        self.surname.textChanged.connect(self.refresh)
+        layout.addWidget(self.surname)
+        self.name = QLineEdit()
+        self.name.setPlaceholderText("Name")
+        self.name.textChanged.connect(self.refresh)
+        layout.addWidget(self.name)
+
+        self.exams = QListWidget()
+        self.exams.itemDoubleClicked.connect(self.open_exam)
+        layout.addWidget(self.exams)
+
+        open_btn = QPushButton(text="OPEN")
+        open_btn.clicked.connect(lambda: self.open_exam(self.exams.currentItem()))
+        layout.addWidget(open_btn)
+        self.setLayout(layout)
+        self.refresh()
+
+    def refresh(self):
+        """ Lists the exams matching the names typed so far, the most recent first """
+        self.exams.clear()
+        for exam in self.store.find_exams(surname=self.surname.text(), name=self.name.text()):
+            text = "{} {}, born {}, acquired {}: {} pathological areas".format(
+                exam['surname'], exam['name'], exam['date_of_birth'] or "-", exam['date_of_acquisition'] or "-",
+                exam['pathological_areas'])
+            item = QListWidgetItem(text)
+            item.setData(Qt.UserRole, exam['id'])
+            self.exams.addItem(item)
+
+    def open_exam(self, item):
+        if item is None:
+            return
+        self.exam_id = item.data(Qt.UserRole)
+        self.accept()
+
+
+class TraceSummaryDialog(QDialog):
+    '''
+    Rolling summary of the traced latencies, refreshed every second
+    '''
+    def __init__(self, parent=None):
+        super(TraceSummaryDialog, self).__init__(parent)
+        self.setWindowTitle("Latency summary")
+        layout = QVBoxLayout()
+
+        self.enabled_box = QCheckBox("Tracing enabled")
+        self.enabled_box.setChecked(TRACER.enabled)
+        self.enabled_box.toggled.connect(TRACER.enable)
+        layout.addWidget(self.enabled_box)
+
+        self.summary_label = QLabel()
+        self.summary_label.setStyleSheet("font-family: monospace;")
+        layout.addWidget(self.summary_label)
+
+        buttons = QHBoxLayout()
+        export_btn = QPushButton(text="EXPORT CHROME TRACE")
+        export_btn.clicked.connect(self.export_trace)
+        buttons.addWidget(export_btn)
+        clear_btn = QPushButton(text="CLEAR")
+        clear_btn.clicked.connect(self.clear)
+        buttons.addWidget(clear_btn)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start()
+        self.refresh()
+
+    def refresh(self):
+        self.summary_label.setText(TRACER.format_summary())
+
+    def export_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export trace", "trace.json", "JSON (*.json)")
+        if len(path) > 0:
+            TRACER.export_chrome_trace(path)
+
+    def clear(self):
+        TRACER.clear()
+        self.refresh()
 
 
 class App(QWidget):
     """ GUI """
+    # emitted with the loading time when the classifier can classify without delay
+    classifier_ready = pyqtSignal(float)
+
     def __init__(self):
         super().__init__()
         self.title 				= 'Lung areas scoring'
@@ -224,11 +460,13 @@ class App(QWidget):
         self.height 			= self.top_row_height + self.bottom_row_height
         self.video_label_width  = 600 # height computed automatically to preserve aspect ratio
 
-        self.tmp_dir = os.getcwd()+"/tmp"
         self.lungs_template_page_name = "image_webView.html"
         self.lungs_customized_page_name = "image_customized.html"
         self.lungs_template_page = os.getcwd()+"/resources/"+self.lungs_template_page_name
         self.lungs_customized_page = os.getcwd()+"/resources/"+self.lungs_customized_page_name
+        self.store_path = os.getcwd()+"/patients.sqlite"
+        # TFClassifier, unless classifier.json selects another backend, e.g. {"backend": "tflite", "quantization": "int8"}
+        self.classifier = classifier_from_config(os.getcwd()+"/classifier.json")
         # Mac
         self.ffmpeg_bin = os.getcwd()+"/bin/ffmpeg"
         # Windows
@@ -236,16 +474,37 @@ class App(QWidget):
 
         self.init_ui()
 
-        self.threadpool = QThreadPool()
+        # Inference and reports share the CPU, the interactive jobs first; ffmpeg encodes run on their own
+        self.scheduler = JobScheduler({CPU: 2, FFMPEG: MAX_PARALLEL_ENCODES}, parent=self)
+        self.report_queue = ReportExportQueue(self.scheduler, parent=self)
+        self.report_queue.signals.progress.connect(self.process_report_progress)
+        self.report_queue.signals.error.connect(self.process_report_error)
+        self.frame_grabber = FrameGrabber()
+        # the decoder of the crop window stays open while the slider is moved
+        self.frame_scrubber = FrameScrubber(self.frame_grabber, parent=self)
+        self.frame_scrubber.frame_ready.connect(self.show_scrubbed_frame)
+        self.video_frame_size = None
+        # patients, exams and scores are saved as soon as they are available
+        self.store = PatientStore(self.store_path)
+        self.exam_id = None
+        self.crop_started = None
         self._dialogs = []
         self.html = ""
-        self.task = ""
+        self.task = ExamResult()
+        # scores of the areas of the current exam
+        self.aggregator = ScoreAggregator()
 
-        self.create_directory(self.tmp_dir)
         # used when user wants to reset everything. Needed to choose the image file page to load
         self.startNewSession = True
         self.clickedAreaName = ""
 
+        # F12 shows the latencies of the traced operations
+        QShortcut(QKeySequence("F12"), self, self.show_trace_summary)
+
+        # the model is loaded once the window is shown
+        self.classifier_is_ready = False
+        QTimer.singleShot(0, self.start_warm_up)
+
 
     def init_ui(self):
         """
@@ -290,6 +549,13 @@ class App(QWidget):
         self.reset_btn.clicked.connect(self.reset_session)
 
         panel_top_left.addWidget(self.reset_btn)
+
+        self.open_exam_btn = QPushButton(text="OPEN EXAM")
+        self.open_exam_btn.setFixedHeight(button_height)
+        self.open_exam_btn.setStyleSheet(button_style)
+        self.open_exam_btn.clicked.connect(self.choose_exam)
+
+        panel_top_left.addWidget(self.open_exam_btn)
        
         registry = QVBoxLayout()
 
@@ -318,7 +584,7 @@ class App(QWidget):
         dob_btn.setIconSize(QSize(button_height, button_height))
         dob_btn.setStyleSheet("border:none")
         dob_grid.addWidget(dob_btn, 0, 0)
-        self.date_of_birth = ClickableQLabel(self)
+        self.date_of_birth = DateLabel(self)
         self.date_of_birth.clicked.connect(self.set_date_of_birth)
         self.date_of_birth.setFixedHeight(self.surname.sizeHint().height())
         self.date_of_birth.setStyleSheet(clickable_label_style)
@@ -339,7 +605,7 @@ class App(QWidget):
         doa_btn.setStyleSheet("border:none")
 
         doa_grid.addWidget(doa_btn, 0, 0)
-        self.date_of_acquisition = ClickableQLabel(self)
+        self.date_of_acquisition = DateLabel(self)
         self.date_of_acquisition.clicked.connect(self.set_date_of_acquisition)
         self.date_of_acquisition.setFixedHeight(self.surname.sizeHint().height())
         self.date_of_acquisition.setStyleSheet(clickable_label_style)
@@ -455,6 +721,8 @@ class App(QWidget):
 
         self.webpage.load(QUrl(Path(self.lungs_template_page).absolute().as_uri()))
         self.webpage.signals.id.connect(self.choose_video_file)
+        # The colors of the areas are pushed into the loaded page, the page is saved only as a copy
+        self.lung_map = LungMap(self.webpage, self.lungs_template_page, self.lungs_customized_page, parent=self)
 
         layout.addWidget(self.webview, 0, 1)
         self.webview.show()
@@ -479,6 +747,12 @@ class App(QWidget):
         self.video_label.setMinimumSize(1,1)
         panel_video.addWidget(self.video_label)
 
+        # Moves through the frames of the video, to place the crop square
+        self.frame_slider = QSlider(Qt.Horizontal)
+        self.frame_slider.setRange(0, 0)
+        self.frame_slider.valueChanged.connect(self.scrub_video)
+        panel_video.addWidget(self.frame_slider)
+
         self.crop_btn = QPushButton(text="CROP VIDEO")
         self.crop_btn.setFixedHeight(button_height)
         self.crop_btn.setStyleSheet(button_style)
@@ -486,6 +760,18 @@ class App(QWidget):
 
         panel_video.addWidget(self.crop_btn)
 
+        # The classifier crops the frames in memory, the crop is saved only on request
+        self.crop_export_mode = QComboBox()
+        self.crop_export_mode.setStyleSheet(text_style)
+        for mode, crop_mode in CROP_MODES.items():
+            self.crop_export_mode.addItem(crop_mode.label, mode)
+        self.crop_export_mode.currentIndexChanged.connect(self.show_crop_export_cost)
+        panel_video.addWidget(self.crop_export_mode)
+        # Expected cost of the selected mode, then progress of the export
+        self.crop_export_status = QLabel()
+        self.crop_export_status.setStyleSheet(text_style)
+        panel_video.addWidget(self.crop_export_status)
+
         self.gray_label = QLabel(self.video_label)
         self.gray_label.setStyleSheet("border: 0px; background-color: rgba(124, 124, 124, 160);")
         self.gray_label.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
@@ -531,12 +817,51 @@ class App(QWidget):
         self.show()
 
 
+    def start_warm_up(self):
+        """ Called at the first iteration of the event loop: the window is on screen """
+        startup = time.perf_counter() - STARTED
+        print("Window shown in {:.2f}s (target {:.2f}s)".format(startup, STARTUP_TARGET))
+        if startup > STARTUP_TARGET:
+            print("Warning: startup slower than the target")
+
+        self.setWindowTitle(self.title + " - loading the model...")
+        worker = WarmupWorker(self.classifier)
+        worker.signals.result.connect(self.process_warm_up_result)
+        worker.signals.error.connect(self.process_warm_up_error)
+        self.scheduler.submit(worker, CPU, BACKGROUND, key="warm-up")
+
+
+    def process_warm_up_result(self, load_time):
+        self.classifier_is_ready = True
+        self.setWindowTitle(self.title)
+        print("Model ready in {:.2f}s, {:.2f}s after startup".format(load_time, time.perf_counter() - STARTED))
+        self.classifier_ready.emit(load_time)
+
+
+    def process_warm_up_error(self, message):
+        self.setWindowTitle(self.title)
+        QMessageBox.about(self, "Model", "Could not load the model: " + message)
+
+
+    def show_trace_summary(self):
+        dialog = TraceSummaryDialog(self)
+        dialog.show()
+
+
+    def closeEvent(self, event):
+        # Reports not started yet are dropped, the running ones are completed;
+        # the classifications are interrupted
+        self.report_queue.cancel()
+        self.scheduler.cancel_all()
+        self.frame_scrubber.close()
+        self.save_exam()
+        super().closeEvent(event)
+
     def select_date(self, label):
         widget = Calendar()
         widget.setWindowModality(Qt.ApplicationModal)
         widget.exec_()
-        result = widget.selectedDate
-        label.setText(result)
+        label.setDate(widget.selectedQDate)
 
     def set_date_of_birth(self):
         self.select_date(self.date_of_birth)
@@ -551,9 +876,9 @@ class App(QWidget):
 
         if len(data_path) == 0:
             return
-        worker = Worker(data_path, TFClassifier)
-        worker.signals.result.connect(self.process_result)
-        self.threadpool.start(worker)
+        worker = Worker({'working_dir': data_path}, self.classifier)
+        worker.signals.result.connect(self.scheduler.deliver(worker, self.process_result))
+        self.scheduler.submit(worker, CPU, INTERACTIVE, key="working-dir")
 
 
     def choose_video_file(self, areaID):
@@ -566,87 +891,130 @@ class App(QWidget):
 
         self.clickedAreaName = areaID # to be used later in HTML substitution
         self.video_file_path = dialogResult[0]
-        self.frame_path = ""
         self.extract_video_frame(self.video_file_path)
 
     @pyqtSlot()
     def reset_session(self):
-        """ In case user wants to start from scracth, template image webview page has to be loaded"""
+        """ In case user wants to start from scracth, all the areas are set back to the template color"""
         self.startNewSession = True
-        # set the template page in the webView
-        self.webpage.load(QUrl(Path(self.lungs_template_page).absolute().as_uri()))
+        self.lung_map.reset()
+        # the current exam stays in the store, the next score starts a new one
+        self.save_exam()
+        self.exam_id = None
+        self.aggregator.reset()
+        self.task = ExamResult()
         # delete the customized page if present
         if(os.path.exists(self.lungs_customized_page)):
             os.remove(self.lungs_customized_page)
 
 
 
+    @traced("process_result")
     def process_result(self, task):
-        """ Retrieves the output of a task """
-
-        task_dict = json.loads(task)
-        self.task = task
-        #html = customize_report("resources/image.html", task)
-
-        html = ""
+        """ Retrieves the ExamResult of a task """
 
-        if(self.startNewSession):
-            shutil.copy(self.lungs_template_page, self.lungs_customized_page)
-            self.startNewSession = False
-
-        with open(self.lungs_customized_page) as file:
-            html = "".join(file.readlines())
-
-        if len(html) == 0:
-            raise RuntimeError("The HTML template must not be empty")
-
-        if(self.clickedAreaName == ""):
-            raise RuntimeError("Clicked area name must not be empty")
+        if task.error is not None:
+            self.video_crop_window.hide()
+            self.gray_label.hide()
+            self.m_movie_gif.stop()
+            self.m_label_gif.hide()
+            QMessageBox.about(self, "Classification Result", "Could not classify the video\n" + task.error)
+            return
 
-        newColorInt = task_dict[self.clickedAreaName[1:]]  # strip initial _ character
-        newColorClass = self.int_to_color_map[newColorInt] # must be same as in html CSS color class name
+        # the areas scored by the task, usually the one that was clicked
+        scored = [KEYS[i] for i in np.flatnonzero(task.scores != NOT_MEASURED)]
+        if len(scored) == 0:
+            self.video_crop_window.hide()
+            self.gray_label.hide()
+            self.m_movie_gif.stop()
+            self.m_label_gif.hide()
+            QMessageBox.about(self, "Classification Result", "Could not decode any frame of the video")
+            return
 
-        # find id attribute in HTML path tag to change color specifically for one area
-        matches = re.findall(r'<path id=\"'+self.clickedAreaName+'\" class=\"(.+?)\"', html)
-        
-        oldPath = ""
-        newPath = ""
-        paths = re.findall(r'<path.+?</path>', html)
-        for path in paths:
-            if(self.clickedAreaName in path):
-                oldPath = path
-                matches = re.findall(r'class=\"(.+?)\"', path)
-                if(len(matches) == 1):
-                    newPath = path.replace(matches[0], newColorClass)
+        for area in scored:
+            # only the row of the area is recomputed
+            self.aggregator.update_row(area, task.probabilities[KEY_INDEX[area]])
+            newColorInt = int(self.aggregator.scores[KEY_INDEX[area]])
+            newColorClass = self.int_to_color_map[newColorInt] # must be same as in html CSS color class name
+
+            # only the scored area is updated in the loaded page
+            self.lung_map.set_area("_" + area, newColorClass)
+            video_path, crop = task.sources.get(area, ("", None))
+            self.save_area_score(area, newColorInt, video_path, crop)
+        self.startNewSession = False
+        self.task = self.aggregator.apply(task)
+        if self.crop_started is not None:
+            TRACER.add_span("crop_to_result", self.crop_started, time.perf_counter() - self.crop_started)
+            self.crop_started = None
+
+        self.show_totals()
+
+        self.video_crop_window.hide()
+        self.gray_label.hide()
+        self.m_movie_gif.stop()
+        self.m_label_gif.hide()
 
-        if(oldPath != "" and newPath != ""):
-            html = html.replace(oldPath, newPath)
 
-            # replace in the template also the page name in the links
-            # TODO: do it only if it is start of new session
-            html = html.replace(self.lungs_template_page_name, self.lungs_customized_page_name)
+    def show_totals(self):
+        """ Shows the number of areas of each score """
+        counts = self.aggregator.counts
+        self.pathological_areas.setText("Pathological areas: <b>{}/14</b>".format(self.aggregator.pathological_areas))
+        self.number_whites.setText(str(counts[0]))
+        self.number_yellow.setText(str(counts[1]))
+        self.number_orange.setText(str(counts[2]))
+        self.number_red.setText(str(counts[3]))
+        self.number_grey.setText(str(counts[NOT_MEASURED]))
 
-            self.html = html
 
-            export_html(html, self.lungs_customized_page)
+    def choose_exam(self):
+        """ Opens the search of the stored exams """
+        dialog = ExamSearchDialog(self.store, self)
+        if dialog.exec_() == QDialog.Accepted and dialog.exam_id is not None:
+            self.open_exam(dialog.exam_id)
 
-            self.webpage.load(QUrl(Path(self.lungs_customized_page).absolute().as_uri()))
 
-            self.pathological_areas.setText("Pathological areas: <b>{}/14</b>".format(task_dict['pathological_areas']))
-            self.number_whites.setText(str(task_dict['n_score_0']))
-            self.number_yellow.setText(str(task_dict['n_score_1']))
-            self.number_orange.setText(str(task_dict['n_score_2']))
-            self.number_red.setText(str(task_dict['n_score_3']))
-            self.number_grey.setText(str(task_dict['n_not_measured']))
+    def open_exam(self, exam_id):
+        """ Shows a stored exam, its scores are read from the store and not computed again """
+        exam = self.store.load_exam(exam_id)
+        if exam is None:
+            return
+        self.reset_session()
+        self.exam_id = exam_id
+        self.name.setText(exam['name'])
+        self.surname.setText(exam['surname'])
+        self.date_of_birth.setIsoDate(exam['date_of_birth'])
+        self.date_of_acquisition.setIsoDate(exam['date_of_acquisition'])
+        self.clinician_notes.setPlainText(exam['notes'])
+
+        task = ExamResult()
+        for area, stored in exam['areas'].items():
+            # only the scores are stored: the whole probability goes to the stored score
+            self.aggregator.update_row(area, np.eye(N_SEVERITIES)[stored['score']])
+            self.lung_map.set_area("_" + area, self.int_to_color_map[stored['score']])
+            task.sources[area] = (stored['video_path'], stored['crop'])
+        self.startNewSession = len(exam['areas']) == 0
+        self.task = self.aggregator.apply(task)
+        self.show_totals()
+
+
+    def save_area_score(self, area, score, video_path, crop):
+        """
+        Stores the score of an area in the current exam, creating the exam at the first score
 
-            self.video_crop_window.hide()
-            self.gray_label.hide()
-            self.m_movie_gif.stop()
-            self.m_label_gif.hide()
+        :param video_path, crop: the video and the crop rectangle the score was computed from
+        """
+        if self.exam_id is None:
+            self.exam_id = self.store.create_exam(self.name.text(), self.surname.text(), self.date_of_birth.isoDate(),
+                                                  self.date_of_acquisition.isoDate(), self.clinician_notes.toPlainText())
+        self.store.save_area(self.exam_id, area, score, video_path, crop)
 
 
-        else:
-            raise RuntimeError("Error while customizing html template")
+    def save_exam(self):
+        """ Stores the patient data and the notes of the current exam, if any """
+        if self.exam_id is None:
+            return
+        self.store.update_exam(self.exam_id, self.name.text(), self.surname.text(), self.date_of_birth.isoDate(),
+                               self.date_of_acquisition.isoDate(), self.clinician_notes.toPlainText())
 
 
     def show_alert(self, task_dict, fields):
@@ -686,75 +1054,99 @@ class App(QWidget):
         output_dir = QFileDialog.getExistingDirectory(self, "Select folder")
         if len(output_dir) == 0:
             return
-        html = customize_report("resources/report.html", self.task)
         totals = [k.text() for k in [self.number_whites, self.number_yellow, self.number_orange, self.number_red, self.number_grey]]
 
         name = self.name.text()
         surname = self.surname.text()
         dob = self.date_of_birth.text()
         doa = self.date_of_acquisition.text()
+        self.save_exam()
+
+        self.report_queue.submit([ReportJob(output_dir, self.task, name, surname, dob, doa,
+                self.pathological_areas.text(), totals, self.clinician_notes.toPlainText())])
+
+
+    def process_report_progress(self, done, total):
+        """ Shows the progress of the reports exported in background """
+        if total == 0 or done == total:
+            self.generate_report_btn.setText("GENERATE REPORT")
+        else:
+            self.generate_report_btn.setText("EXPORTING REPORTS ({}/{})".format(done, total))
 
-        html = generate_output_html(html, name, surname, dob, 
-                doa, self.pathological_areas.text(), totals, self.clinician_notes.toPlainText())
-        
-        export_html(html, os.path.join(output_dir, "Report.html"))
-        export_pdf(html, os.path.join(output_dir, "{}{}_{}_{}.pdf".format(surname, name, dob, doa)))
 
+    def process_report_error(self, message):
+        QMessageBox.about(self, "Report Result", "Could not export the report of " + message)
 
+
+    @traced("frame_extract")
     def extract_video_frame(self, file_name):
-        """ Open video with ffmpeg and get file_number frame. Not efficient for multiple calls"""
-        self.delete_folder_contents(self.tmp_dir)
+        """
+        Opens the video in the scrubber of the crop window and shows its first frame. The decoder
+        stays open, so the other frames shown with the slider are decoded without reopening the
+        video, in background, and are cached scaled for the display.
+        """
+        if not self.frame_scrubber.open(file_name):
+            QMessageBox.about(self, "Extraction Result", "Could not extract frame from video")
+            return
 
-        commandStringList = [
-            self.ffmpeg_bin, '-i', file_name, '-vframes', '1' ,'-f','image2',
-            self.tmp_dir + '/frame%03d.jpeg'
-        ]
+        image = self.frame_scrubber.frame(0)
+        if image is None:
+            QMessageBox.about(self, "Extraction Result", "Could not extract frame from video")
+            return
 
-        videoworker = VideoWorker(commandStringList, "success", "fail")
-        videoworker.signals.result.connect(self.process_video_frame_result)
-        self.threadpool.start(videoworker)
+        # the displayed frames may be scaled down, the crop is computed on the original size
+        self.video_frame_size = (self.frame_grabber.width, self.frame_grabber.height)
+        self.frame_slider.blockSignals(True)
+        self.frame_slider.setRange(0, max(0, self.frame_grabber.frame_count - 1))
+        self.frame_slider.setValue(0)
+        self.frame_slider.blockSignals(False)
 
+        self.process_video_frame_result(QPixmap.fromImage(image))
+        self.show_crop_export_cost()
 
-    def process_video_frame_result(self, task):
-        """ Async call to process frame extraction result """
 
-        task_dict = json.loads(task)
+    def scrub_video(self, index):
+        """ Shows a frame of the video selected with the slider, right away if it is cached """
+        image = self.frame_scrubber.request(index)
+        if image is not None:
+            self.video_label.setPixmap(QPixmap.fromImage(image))
 
-        if(task_dict["value"] == "success"):
-            frame_basenames = sorted(
-                list(filter(re.compile(r'frame').search, os.listdir(self.tmp_dir))))
 
-            self.frame_path = os.path.join(self.tmp_dir, frame_basenames[0])
-        else:
-            self.frame_path = ""
-            QMessageBox.about(self, "Extraction Result", "Could not extract frame from video")
+    def show_scrubbed_frame(self, index, image):
+        """ Shows a frame decoded in background, unless the slider has moved on """
+        if index == self.frame_slider.value():
+            self.video_label.setPixmap(QPixmap.fromImage(image))
 
 
-        if(self.frame_path != ""):
+    def process_video_frame_result(self, pixmap):
+        """ Shows the extracted frame in the crop window """
 
-            pixmap = QPixmap(self.frame_path)
-            # calculate a view that preserves aspect ratio of video frame
-            video_aspect_ratio = pixmap.height() / pixmap.width()
-            video_label_height = int((video_aspect_ratio*self.video_label_width))
+        # calculate a view that preserves aspect ratio of video frame
+        video_aspect_ratio = pixmap.height() / pixmap.width()
+        video_label_height = int((video_aspect_ratio*self.video_label_width))
 
-            self.video_label.setFixedWidth(pixmap.width())
-            self.video_label.setFixedHeight(pixmap.height())
-            self.crop_btn.setFixedWidth(pixmap.width())
+        self.video_label.setFixedWidth(pixmap.width())
+        self.video_label.setFixedHeight(pixmap.height())
+        self.crop_btn.setFixedWidth(pixmap.width())
+        self.frame_slider.setFixedWidth(pixmap.width())
 
-            self.gray_label.setGeometry(0,0,pixmap.width(),pixmap.height())
+        self.gray_label.setGeometry(0,0,pixmap.width(),pixmap.height())
 
-            self.video_label.setPixmap(pixmap)
+        self.video_label.setPixmap(pixmap)
 
-            # center crop square only at beginning of each session
-            if(self.startNewSession):
-                self.video_label.rubberBand.setGeometry((pixmap.width() / 2) - (self.video_label.minSquareSide / 2), (pixmap.height() / 2) - (self.video_label.minSquareSide / 2), self.video_label.minSquareSide, self.video_label.minSquareSide)
+        # center crop square only at beginning of each session
+        if(self.startNewSession):
+            self.video_label.rubberBand.setGeometry((pixmap.width() / 2) - (self.video_label.minSquareSide / 2), (pixmap.height() / 2) - (self.video_label.minSquareSide / 2), self.video_label.minSquareSide, self.video_label.minSquareSide)
 
-            self.panel_video_frame.setFocus()
-            self.video_crop_window.show()
+        self.panel_video_frame.setFocus()
+        self.video_crop_window.show()
 
 
     def crop_video(self):
         """Crop from ffmpeg using scaled pixels of rubber band"""
+        start = time.perf_counter()
+        # the time from the crop to the colored area is traced in process_result
+        self.crop_started = start
 
         self.gray_label.show()
         self.m_movie_gif.start()
@@ -769,67 +1161,65 @@ class App(QWidget):
         # need to compensate in case video view has aspect ratio different than the original video, for UI reasons
         # a scale factor has to be applied from label space to video space, asuming
         # that the aspect ratio of the label was the same of the video
-        labelToVideoScaleWidth = self.video_label.pixmap().width() / self.video_label.width()
-        labelToVideoScaleHeight = self.video_label.pixmap().height() / self.video_label.height()
-        videoWidth = self.video_label.pixmap().width()
-        videoHeight = self.video_label.pixmap().height()
+        videoWidth, videoHeight = self.video_frame_size
+        labelToVideoScaleWidth = videoWidth / self.video_label.width()
+        labelToVideoScaleHeight = videoHeight / self.video_label.height()
         videoFrameSpaceX = int((labelToVideoScaleWidth*labelX))
         videoFrameSpaceY = int((labelToVideoScaleHeight*labelY))
         videoFrameSpaceRight = int((labelToVideoScaleWidth*labelRight))
         videoFrameSpaceBottom = int((labelToVideoScaleHeight*labelBottom))
 
-        pre, ext = os.path.splitext(self.video_file_path)
-        new_video_name = pre+"_cropped"+ext
+        crop = [videoFrameSpaceX, videoFrameSpaceY, videoFrameSpaceRight-videoFrameSpaceX, videoFrameSpaceBottom-videoFrameSpaceY]
 
-        #note: -crf 15 is the quality of exported video. See ffmpeg doc
-        commandStringList = [
-            self.ffmpeg_bin, '-y','-i', self.video_file_path, 
-            '-filter:v',
-            'crop='+str(videoFrameSpaceRight-videoFrameSpaceX)+':'+str(videoFrameSpaceBottom-videoFrameSpaceY)+':'+str(videoFrameSpaceX)+':'+str(videoFrameSpaceY)+'' ,
-            '-crf',
-            '15', 
-            new_video_name
-        ]
+        # Classify right away, cropping the decoded frames in memory
+        # A newer crop of the same area supersedes the one still being classified
+        area = self.clickedAreaName[1:]
+        worker = Worker({'video_file': self.video_file_path, 'crop': crop, 'area': area}, self.classifier)
+        worker.signals.result.connect(self.scheduler.deliver(worker, self.process_result))
+        self.scheduler.submit(worker, CPU, INTERACTIVE, key=("inference", area))
+
+        mode = self.crop_export_mode.currentData()
+        if mode == METADATA:
+            # The original video is kept, the crop is applied when it is decoded
+            write_crop_sidecar(self.video_file_path, crop)
+        elif mode != NONE:
+            self.export_cropped_video(crop, mode)
+        TRACER.add_span("crop_video", start, time.perf_counter() - start)
 
-        videoworker = VideoWorker(commandStringList, "success", "Error exporting cropped video")
-        videoworker.signals.result.connect(self.process_video_crop_result)
-        self.threadpool.start(videoworker)
 
+    def show_crop_export_cost(self):
+        """ Shows the expected cost of the selected mode of export, for the open video """
+        duration = self.frame_grabber.frame_count / self.frame_grabber.fps if self.frame_grabber.fps > 0 else 0
+        mode = CROP_MODES[self.crop_export_mode.currentData()]
+        self.crop_export_status.setText("" if mode is CROP_MODES[NONE] else "Expected: " + mode.expected_cost(duration))
 
-    def process_video_crop_result(self, task):
-        """ Retrieves the output of a task """
-        task_dict = json.loads(task)
-        if(task_dict["value"] != "success" ):
-            QMessageBox.about(self, "Crop Result", task_dict["value"])
 
-        # clean tmp folder 
-        self.delete_folder_contents(self.tmp_dir)
+    def export_cropped_video(self, crop, mode):
+        """ Exports the cropped video with ffmpeg in background, with a mode of crop_export.CROP_MODES """
+        commandStringList, _ = crop_command(self.ffmpeg_bin, self.video_file_path, crop, mode)
 
-        dir = os.path.dirname(self.video_file_path)
-        worker = Worker(dir, TFClassifier)
-        worker.signals.result.connect(self.process_result)
-        self.threadpool.start(worker)
+        videoworker = VideoWorker(commandStringList, "success", "Error exporting cropped video")
+        videoworker.signals.progress.connect(self.scheduler.deliver(videoworker, self.process_video_crop_progress))
+        videoworker.signals.result.connect(self.scheduler.deliver(videoworker, self.process_video_crop_result))
+        self.scheduler.submit(videoworker, FFMPEG, INTERACTIVE, key=("crop", self.clickedAreaName[1:]))
 
 
-    #TODO put in utils    
-    def create_directory(self, directory):
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+    def process_video_crop_progress(self, done, total):
+        """ Shows the progress of the export of the cropped video """
+        if total > 0:
+            self.crop_export_status.setText("Exporting the cropped video: {}%".format(min(100, 100 * done // total)))
 
 
-    def delete_folder_contents(self, directory):
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                print('Failed to delete %s. Reason: %s' % (file_path, e))
+    def process_video_crop_result(self, message):
+        """ Retrieves the output of the export of the cropped video """
+        self.show_crop_export_cost()
+        if(message != "success" ):
+            QMessageBox.about(self, "Crop Result", message)
 
 
 if __name__ == '__main__':
+    # The workers of the process backend (see process_pool) start from this file in the packaged executable
+    multiprocessing.freeze_support()
     app = QApplication([""])
     ex = App()
     sys.exit(app.exec_())
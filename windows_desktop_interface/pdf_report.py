@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+"""
+This file contains the native PDF renderer of the reports, based on reportlab.
+
+The lung map is drawn directly from the SVG embedded in the HTML report template, which
+is parsed only once. The static parts of the page (logo, outline and labels of the lung
+map) are stored as form XObjects, defined once per document and reused by every page.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import re
+import functools
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfgen import canvas
+from utilities import KEYS, COLORS, patient_values
+
+
+# Same colors as the CSS classes of the templates
+FILLS = {
+    "white": colors.HexColor("#FFFFFF"),
+    "yellow": colors.HexColor("#FFFF80"),
+    "orange": colors.HexColor("#F59A23"),
+    "red": colors.HexColor("#D9001B"),
+    "grey": colors.HexColor("#7D7C7C"),
+}
+
+_TOKEN = re.compile(r'[MmLlHhVvCcSsQqTtZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_N_ARGS = {'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2}
+_ATTRIBUTE = re.compile(r'([\w:-]+)="([^"]*)"')
+
+
+def parse_path(d, dx=0.0, dy=0.0):
+    """
+    Converts SVG path data into a list of drawing operations in absolute coordinates:
+    ('moveTo', x, y), ('lineTo', x, y), ('curveTo', x1, y1, x2, y2, x, y) and ('close',).
+    Quadratic curves are converted to cubic ones.
+
+    :param dx, dy: translation applied to all the points
+    """
+    tokens = _TOKEN.findall(d)
+    ops = []
+    x = y = start_x = start_y = 0.0
+    cubic_ctrl = quad_ctrl = None
+    command = None
+    i = 0
+
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command in "Zz":
+                ops.append(('close',))
+                x, y = start_x, start_y
+                cubic_ctrl = quad_ctrl = None
+                continue
+
+        upper = command.upper()
+        n_args = _N_ARGS[upper]
+        args = [float(token) for token in tokens[i:i + n_args]]
+        i += n_args
+        if len(args) < n_args:
+            break
+        # Relative commands are offsets from the current point
+        if command.islower():
+            if upper == 'H':
+                args = [args[0] + x]
+            elif upper == 'V':
+                args = [args[0] + y]
+            else:
+                args = [value + (x if j % 2 == 0 else y) for j, value in enumerate(args)]
+
+        next_cubic = next_quad = None
+        if upper == 'M':
+            x, y = start_x, start_y = args
+            ops.append(('moveTo', x, y))
+            # Following coordinate pairs are implicit line commands
+            command = 'l' if command.islower() else 'L'
+        elif upper in 'LHV':
+            if upper == 'H':
+                x = args[0]
+            elif upper == 'V':
+                y = args[0]
+            else:
+                x, y = args
+            ops.append(('lineTo', x, y))
+        elif upper in 'CS':
+            if upper == 'C':
+                x1, y1, x2, y2, end_x, end_y = args
+            else:
+                x1, y1 = (2 * x - cubic_ctrl[0], 2 * y - cubic_ctrl[1]) if cubic_ctrl else (x, y)
+                x2, y2, end_x, end_y = args
+            ops.append(('curveTo', x1, y1, x2, y2, end_x, end_y))
+            next_cubic = (x2, y2)
+            x, y = end_x, end_y
+        else:
+            if upper == 'Q':
+                qx, qy, end_x, end_y = args
+            else:
+                qx, qy = (2 * x - quad_ctrl[0], 2 * y - quad_ctrl[1]) if quad_ctrl else (x, y)
+                end_x, end_y = args
+            ops.append(('curveTo', x + 2 / 3 * (qx - x), y + 2 / 3 * (qy - y),
+                        end_x + 2 / 3 * (qx - end_x), end_y + 2 / 3 * (qy - end_y), end_x, end_y))
+            next_quad = (qx, qy)
+            x, y = end_x, end_y
+        cubic_ctrl, quad_ctrl = next_cubic, next_quad
+
+    if dx or dy:
+        ops = [(op[0],) + tuple(value + (dx if j % 2 == 0 else dy) for j, value in enumerate(op[1:])) for op in ops]
+    return ops
+
+
+def _translation(attributes):
+    match = re.match(r'translate\(\s*([-\d.]+)[\s,]+([-\d.]+)\s*\)', attributes.get('transform', ""))
+    return (float(match.group(1)), float(match.group(2))) if match else (0.0, 0.0)
+
+
+class LungMapGeometry:
+    """ Shapes of the lung map, parsed from the SVG of the report template """
+    def __init__(self, svg):
+        self.view_box = [float(value) for value in re.search(r'viewBox="([^"]*)"', svg).group(1).split()]
+        self.areas = {}  # area key -> operations
+        self.lines = []  # filled black shapes
+        self.outlines = []  # stroked shapes
+        self.labels = []  # (x, y, text, bold)
+
+        for tag, attribute_source, text in re.findall(r'<(path|rect|polygon|text)\b([^>]*?)/?>(?:([^<]*)</text>)?', svg):
+            attributes = dict(_ATTRIBUTE.findall(attribute_source))
+            css_class = attributes.get('class', "")
+            dx, dy = _translation(attributes)
+
+            if tag == 'text':
+                self.labels.append((float(attributes['x']), float(attributes['y']), text.strip(),
+                                    attributes.get('font-weight') == "bold"))
+                continue
+            if css_class == "cls-2":
+                # Invisible construction shapes
+                continue
+
+            if tag == 'path':
+                ops = parse_path(attributes['d'], dx, dy)
+            elif tag == 'rect':
+                x, y = float(attributes['x']) + dx, float(attributes['y']) + dy
+                width, height = float(attributes['width']), float(attributes['height'])
+                ops = [('moveTo', x, y), ('lineTo', x + width, y), ('lineTo', x + width, y + height),
+                       ('lineTo', x, y + height), ('close',)]
+            else:
+                values = [float(value) for value in attributes['points'].replace(",", " ").split()]
+                ops = [('moveTo', values[0] + dx, values[1] + dy)]
+                ops += [('lineTo', values[j] + dx, values[j + 1] + dy) for j in range(2, len(values) - 1, 2)]
+                ops.append(('close',))
+
+            if css_class.startswith("_"):
+                self.areas[css_class[1:]] = ops
+            elif css_class == "cls-3":
+                self.outlines.append(ops)
+            else:
+                self.lines.append(ops)
+
+
+@functools.lru_cache(maxsize=None)
+def load_geometry(template_path):
+    """ Returns the LungMapGeometry of the template, parsed only at the first call """
+    with open(template_path) as file:
+        svg = re.search(r'<svg.*?</svg>', file.read(), re.S).group(0)
+    return LungMapGeometry(svg)
+
+
+@functools.lru_cache(maxsize=None)
+def load_image(path):
+    """ Returns the ImageReader of an image, decoded only at the first call """
+    return ImageReader(path)
+
+
+def _draw_ops(pdf, ops, stroke=0, fill=1):
+    path = pdf.beginPath()
+    for op in ops:
+        getattr(path, op[0])(*op[1:])
+    pdf.drawPath(path, stroke=stroke, fill=fill)
+
+
+class PdfReportRenderer:
+    """
+    Renders the reports as PDF without any external process.
+
+    :param template_path: HTML template containing the SVG of the lung map
+    :param logo_path: path of the logo shown in the header
+    """
+    page_size = A4
+    margin = 40
+    map_width = 420
+
+    def __init__(self, template_path="resources/report.html", logo_path="resources/logo_unitn.png"):
+        self.geometry = load_geometry(template_path)
+        self.logo = load_image(logo_path)
+
+    def render(self, output_name, result, name, surname, dob, doa, pathological_areas, totals, notes):
+        """ Renders a report into output_name, same arguments of utilities.render_report """
+        self.render_many(output_name, [(result, name, surname, dob, doa, pathological_areas, totals, notes)])
+
+    def render_many(self, output_name, reports):
+        """ Renders several reports as the pages of a single document, the static parts are stored once """
+        pdf = canvas.Canvas(output_name, pagesize=self.page_size)
+        self._define_forms(pdf)
+        for report in reports:
+            self._draw_page(pdf, *report)
+            pdf.showPage()
+        pdf.save()
+
+    def _define_forms(self, pdf):
+        logo_width, logo_height = self.logo.getSize()
+        pdf.beginForm("logo", 0, 0, logo_width, logo_height)
+        pdf.drawImage(self.logo, 0, 0, logo_width, logo_height, mask='auto')
+        pdf.endForm()
+
+        min_x, min_y, width, height = self.geometry.view_box
+        pdf.beginForm("lung_map", min_x, min_y, min_x + width, min_y + height)
+        pdf.setFillColor(colors.black)
+        for ops in self.geometry.lines:
+            _draw_ops(pdf, ops)
+        pdf.setLineWidth(1)
+        for ops in self.geometry.outlines:
+            _draw_ops(pdf, ops, stroke=1, fill=0)
+        # The form is drawn with the y axis pointing down, as in SVG: the text is flipped back
+        for x, y, text, bold in self.geometry.labels:
+            pdf.saveState()
+            pdf.translate(x, y)
+            pdf.scale(1, -1)
+            pdf.setFont("Helvetica-Bold" if bold else "Helvetica", 18 if bold else 14)
+            pdf.drawString(0, 0, text)
+            pdf.restoreState()
+        pdf.endForm()
+
+    def _draw_page(self, pdf, result, name, surname, dob, doa, pathological_areas, totals, notes):
+        values = patient_values(name, surname, dob, doa, pathological_areas, totals, notes)
+        page_width, page_height = self.page_size
+        top = page_height - self.margin
+
+        # Header
+        logo_width, logo_height = self.logo.getSize()
+        scale = 50.0 / logo_height
+        pdf.saveState()
+        pdf.translate(self.margin, top - 50)
+        pdf.scale(scale, scale)
+        pdf.doForm("logo")
+        pdf.restoreState()
+        pdf.setFont("Helvetica-Bold", 16)
+        pdf.drawRightString(page_width - self.margin, top - 30, "Lung ultrasound report")
+
+        # Patient data
+        y = top - 85
+        for label, key in [("Name", '_name'), ("Last name", '_surname'), ("Date of birth", '_dob'),
+                           ("Date of acquisition", '_doa')]:
+            pdf.setFont("Helvetica-Bold", 11)
+            pdf.drawString(self.margin, y, label + ":")
+            pdf.setFont("Helvetica", 11)
+            pdf.drawString(self.margin + 120, y, values[key])
+            y -= 16
+
+        # Lung map: the areas are filled with the score colors, then the static form is drawn on top
+        min_x, min_y, width, height = self.geometry.view_box
+        scale = self.map_width / width
+        map_top = y - 10
+        pdf.saveState()
+        pdf.translate((page_width - self.map_width) / 2, map_top)
+        pdf.scale(scale, -scale)
+        pdf.translate(-min_x, -min_y)
+        for key in KEYS:
+            pdf.setFillColor(FILLS[COLORS[result[key]]])
+            _draw_ops(pdf, self.geometry.areas[key], stroke=0, fill=1)
+        pdf.doForm("lung_map")
+        pdf.restoreState()
+
+        # Scores
+        y = map_top - height * scale - 25
+        pdf.setFont("Helvetica-Bold", 12)
+        pdf.drawString(self.margin, y, "Pathological areas: {}".format(values['_pathological_areas'].strip()))
+        y -= 30
+        column_width = (page_width - 2 * self.margin - 80) / 5
+        for i, (label, color, total) in enumerate(zip(
+                ["Score 0", "Score 1", "Score 2", "Score 3", "Not measured"],
+                ["white", "yellow", "orange", "red", "grey"],
+                ['_n_white', '_n_yellow', '_n_orange', '_n_red', '_n_grey'])):
+            x = self.margin + 80 + i * column_width
+            pdf.setFont("Helvetica", 10)
+            pdf.drawString(x, y, label)
+            pdf.setFillColor(FILLS[color])
+            pdf.rect(x, y - 20, 50, 12, stroke=1, fill=1)
+            pdf.setFillColor(colors.black)
+            pdf.setFont("Helvetica-Bold", 10)
+            pdf.drawString(x, y - 38, values[total])
+        pdf.drawString(self.margin, y - 38, "Totals:")
+
+        # Notes of the clinician
+        y -= 70
+        pdf.setFont("Helvetica-Bold", 12)
+        pdf.drawString(self.margin, y, "Notes of the clinician")
+        pdf.setFont("Helvetica", 10)
+        for line in notes.splitlines() or [""]:
+            for wrapped in simpleSplit(line, "Helvetica", 10, page_width - 2 * self.margin) or [""]:
+                y -= 14
+                if y < self.margin:
+                    # The notes continue on a new page, the font is reset by showPage
+                    pdf.showPage()
+                    pdf.setFont("Helvetica", 10)
+                    y = top - 14
+                pdf.drawString(self.margin, y, wrapped)
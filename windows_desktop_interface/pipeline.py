@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+"""
+This file contains the streaming pipeline used to classify the videos: a decoder stage
+reads and resizes the frames in a background thread, while the inference stage consumes
+them in batches from a bounded queue.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import time
+import queue
+import threading
+import numpy as np
+from tracing import TRACER
+
+
+# Marker put in the queue by the decoder when there are no more frames
+_END = object()
+
+
+class Cancelled(Exception):
+    """ Raised by FramePipeline.run when the classification is cancelled """
+
+
+class InvalidCrop(ValueError):
+    """ Raised when the crop rectangle does not overlap the frame """
+
+
+def crop_frame(frame, crop):
+    """
+    Returns the part of a frame inside the rectangle [x, y, width, height] (in pixels), as a view.
+    The rectangle is clamped to the frame; a rectangle entirely outside it raises InvalidCrop.
+    """
+    frame_height, frame_width = frame.shape[:2]
+    x, y, width, height = crop
+    left, top = max(0, int(x)), max(0, int(y))
+    right, bottom = min(frame_width, int(x + width)), min(frame_height, int(y + height))
+    if right <= left or bottom <= top:
+        raise InvalidCrop("The crop rectangle {} lies outside the frame ({}x{})".format(list(crop), frame_width, frame_height))
+    return frame[top:bottom, left:right]
+
+
+class StageTimings:
+    """ Wall-clock time spent by each stage of the pipeline, in seconds """
+    def __init__(self):
+        self.decode = 0.0
+        self.resize = 0.0
+        self.decoder_blocked = 0.0  # decoder waiting for room in the queue
+        self.inference = 0.0
+        self.inference_starved = 0.0  # inference waiting for frames
+        self.total = 0.0
+        self.decoded = 0  # frames decoded by the sampler
+        self.frames = 0  # frames actually classified
+        self.batches = 0
+
+    def bottleneck(self):
+        """ Returns the name of the stage that limits the throughput """
+        return "decode" if self.decode + self.resize >= self.inference else "inference"
+
+    def to_dict(self):
+        return {
+            'decode': self.decode,
+            'resize': self.resize,
+            'decoder_blocked': self.decoder_blocked,
+            'inference': self.inference,
+            'inference_starved': self.inference_starved,
+            'total': self.total,
+            'decoded': self.decoded,
+            'frames': self.frames,
+            'batches': self.batches,
+            'bottleneck': self.bottleneck(),
+        }
+
+
+class FramePipeline:
+    """
+    Overlaps the decoding of a video with the inference on its frames.
+
+    :param img_shape: shape of the frames expected by the model
+    :param batch_size: number of frames sent to the model at once
+    :param sampler: the FrameSampler that chooses the frames to classify
+    :param queue_size: maximum number of decoded frames waiting for the inference
+    """
+    def __init__(self, img_shape, batch_size, sampler, queue_size=None):
+        self.img_shape = img_shape
+        self.batch_size = batch_size
+        self.sampler = sampler
+        self.queue_size = queue_size if queue_size is not None else 2 * batch_size
+
+    def _decode(self, video_path, crop, frames, stop, cancelled, timings):
+        """ Decoder stage, runs in a background thread """
+        import cv2
+        try:
+            cap = cv2.VideoCapture(video_path)
+            sampled = self.sampler.frames(cap, timings, video_path)
+            while cap.isOpened() and not stop.is_set() and not cancelled.is_set():
+                start = time.perf_counter()
+                frame = next(sampled, None)
+                elapsed = time.perf_counter() - start
+                timings.decode += elapsed
+                TRACER.add_span("decode", start, elapsed)
+
+                if frame is None or len(frame) == 0:
+                    break
+
+                start = time.perf_counter()
+                if crop is not None:
+                    # Slicing returns a view, the crop itself does not copy the frame
+                    frame = crop_frame(frame, crop)
+                frame = cv2.resize(frame, (self.img_shape[1], self.img_shape[0]))
+                elapsed = time.perf_counter() - start
+                timings.resize += elapsed
+                TRACER.add_span("resize", start, elapsed)
+
+                start = time.perf_counter()
+                frames.put(frame)
+                timings.decoder_blocked += time.perf_counter() - start
+            cap.release()
+            frames.put(_END)
+        except Exception as e:
+            frames.put(e)
+
+    def run(self, video_path, predict, crop=None, cancelled=None):
+        """
+        Classifies the frames of a video.
+
+        :param video_path: path of the video
+        :param predict: function that maps a batch of frames to the outputs of the model
+        :param crop: optional rectangle [x, y, width, height] (in pixels) applied to each frame
+        :param cancelled: optional threading.Event; once set, the decoder stops and Cancelled is raised
+        :returns a tuple (sum of the outputs of the frames or None if no frame was decoded, StageTimings)
+        """
+        timings = StageTimings()
+        frames = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        # The decoder checks the cancellation before every frame
+        cancelled = cancelled if cancelled is not None else threading.Event()
+        decoder = threading.Thread(target=self._decode, args=(video_path, crop, frames, stop, cancelled, timings),
+                                   daemon=True)
+
+        batch = np.empty((self.batch_size, *self.img_shape), dtype=np.float32)
+        clf_output = None
+        n_batch = 0
+        start_total = time.perf_counter()
+        decoder.start()
+
+        try:
+            while True:
+                start = time.perf_counter()
+                item = frames.get()
+                timings.inference_starved += time.perf_counter() - start
+
+                if isinstance(item, Exception):
+                    raise item
+                if cancelled.is_set():
+                    raise Cancelled(video_path)
+                if item is not _END:
+                    batch[n_batch] = item
+                    n_batch += 1
+                    timings.frames += 1
+
+                if n_batch == self.batch_size or (item is _END and n_batch > 0):
+                    start = time.perf_counter()
+                    batch_output = predict(batch[:n_batch]).sum(axis=0)
+                    elapsed = time.perf_counter() - start
+                    timings.inference += elapsed
+                    TRACER.add_span("inference", start, elapsed, {'frames': n_batch})
+                    timings.batches += 1
+
+                    clf_output = batch_output if clf_output is None else clf_output + batch_output
+                    n_batch = 0
+
+                if item is _END:
+                    break
+        finally:
+            # Unblock the decoder if the inference stage failed
+            stop.set()
+            while decoder.is_alive():
+                try:
+                    frames.get_nowait()
+                except queue.Empty:
+                    decoder.join(0.01)
+            timings.total = time.perf_counter() - start_total
+            TRACER.add_span("classify_video", start_total, timings.total, {'video': video_path})
+            TRACER.count("frames_classified", timings.frames)
+
+        return clf_output, timings
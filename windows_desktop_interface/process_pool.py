@@ -0,0 +1,311 @@
+#!/usr/bin/python3
+"""
+This file contains a multi-process implementation of the Classifier interface.
+
+Decoding, preprocessing and inference run in a pool of worker processes, so that they
+are not limited by the GIL. Every worker holds a single copy of the model, and the
+decoded frames move between the processes through shared memory instead of being
+pickled. The shared memory (multiprocessing.shared_memory) needs Python 3.8 or newer:
+on older versions, e.g. with the TensorFlow 2.1 of requirements.txt, every video is decoded
+and classified by the same worker, so that the frames never leave the process.
+
+The results are cached as in TFClassifier; the interface uses this engine when classifier.json
+contains {"backend": "process"}.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+import cv2
+import numpy as np
+from cache import file_digest, open_cache
+from classifiers import TFClassifier
+from crop_export import read_crop_sidecar
+from pipeline import Cancelled, crop_frame
+from results import VideoResult
+from samplers import FirstFramesSampler
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python 3.7 and older
+    shared_memory = None
+
+
+# State of the worker processes, set by _init_worker
+_model_path = None
+_img_shape = None
+_batch_size = None
+
+
+class SharedFrames:
+    """ Description of a block of frames stored in shared memory, cheap to pickle """
+    def __init__(self, name, shape):
+        self.name = name
+        self.shape = shape
+
+    def attach(self):
+        """ Returns (SharedMemory, numpy view on the frames); the SharedMemory must be closed after use """
+        block = shared_memory.SharedMemory(name=self.name)
+        return block, np.ndarray(self.shape, dtype=np.uint8, buffer=block.buf)
+
+
+def _init_worker(model_path, img_shape, batch_size):
+    """ Loads the model once per worker process """
+    global _model_path, _img_shape, _batch_size
+    import tensorflow as tf
+
+    # One thread per process: the parallelism comes from the processes
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    _model_path = model_path
+    _img_shape = img_shape
+    _batch_size = batch_size
+    _load_model()
+
+
+def _load_model():
+    """ Returns the model of the worker, reloaded by the registry if the file changed on disk """
+    from classifiers import MODEL_REGISTRY
+    return MODEL_REGISTRY.get(_model_path, _img_shape)
+
+
+def _ready():
+    """ Does nothing, used to wait for a worker to load its model """
+    return True
+
+
+def _max_frames(video_path, sampler):
+    """ Upper bound of the number of frames the sampler takes from a video """
+    n_frames = getattr(sampler, "n_frames", None)
+    if n_frames is None:
+        # Samplers without a limit, e.g. AllFramesSampler, take every frame of the video
+        cap = cv2.VideoCapture(video_path)
+        n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+    return max(1, n_frames)
+
+
+def _read_frames(video_path, crop, sampler, frames):
+    """
+    Decodes and resizes the sampled frames of a video into frames, at most as many as it holds.
+    Returns the number of frames written.
+    """
+    class Stats:
+        decoded = 0
+
+    n_frames = 0
+    cap = cv2.VideoCapture(video_path)
+    for frame in sampler.frames(cap, Stats, video_path):
+        if n_frames == len(frames):
+            break
+        if crop is not None:
+            frame = crop_frame(frame, crop)
+        frames[n_frames] = cv2.resize(frame, (_img_shape[1], _img_shape[0]))
+        n_frames += 1
+    cap.release()
+    return n_frames
+
+
+def _predict(frames):
+    """ Runs the model on the frames and returns the sum of the outputs """
+    model = _load_model()
+    clf_output = None
+    for start in range(0, len(frames), _batch_size):
+        batch_output = model.predict(frames[start:start + _batch_size]).sum(axis=0)
+        clf_output = batch_output if clf_output is None else clf_output + batch_output
+    return clf_output
+
+
+def _decode(video_path, crop, sampler, shared):
+    """
+    Decodes the sampled frames of a video into a shared memory block created by the parent process.
+    Returns the number of frames written.
+    """
+    block, frames = shared.attach()
+    try:
+        return _read_frames(video_path, crop, sampler, frames)
+    finally:
+        del frames
+        block.close()
+
+
+def _infer(shared):
+    """ Runs the model on the frames stored in shared memory and returns the sum of the outputs """
+    block, frames = shared.attach()
+    try:
+        return _predict(frames)
+    finally:
+        del frames
+        block.close()
+
+
+def _classify(video_path, crop, sampler):
+    """
+    Decodes and classifies a video in the same worker, used when the shared memory is not available.
+    Returns the sum of the outputs of its frames, or None if it has no frames.
+    """
+    frames = np.zeros((_max_frames(video_path, sampler), *_img_shape), dtype=np.uint8)
+    n_frames = _read_frames(video_path, crop, sampler, frames)
+    return _predict(frames[:n_frames]) if n_frames > 0 else None
+
+
+class InferenceEngine:
+    """
+    Pool of worker processes shared by all the ProcessPoolClassifier of the same model,
+    so that areas or patients queued at the same time are spread over all the cores.
+    """
+    _engines = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_path, img_shape, batch_size, n_workers):
+        self.img_shape = img_shape
+        self.n_workers = n_workers
+        # TensorFlow does not survive a fork, the workers are started from scratch
+        self.executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(os.path.abspath(model_path), img_shape, batch_size)
+        )
+
+    @classmethod
+    def get(cls, model_path, img_shape, batch_size, n_workers):
+        key = (os.path.abspath(model_path), img_shape, batch_size, n_workers)
+        with cls._lock:
+            if key not in cls._engines:
+                cls._engines[key] = InferenceEngine(model_path, img_shape, batch_size, n_workers)
+            return cls._engines[key]
+
+    @classmethod
+    def shutdown_all(cls):
+        with cls._lock:
+            for engine in cls._engines.values():
+                engine.executor.shutdown()
+            cls._engines.clear()
+
+    def warm_up(self):
+        """ Starts the worker processes and waits for them to load the model """
+        wait([self.executor.submit(_ready) for _ in range(self.n_workers)])
+
+    def classify_many(self, video_paths, crop, sampler):
+        """
+        Classifies several videos at once. Their decoding and inference overlap in the pool.
+
+        :returns a dictionary mapping each video to the sum of the outputs of its frames (or None if it has no frames)
+        """
+        if shared_memory is None:
+            futures = {self.executor.submit(_classify, path, crop, sampler): path for path in video_paths}
+            return {futures[future]: future.result() for future in as_completed(futures)}
+
+        # The parent process creates and owns the shared memory: on Windows a block is destroyed
+        # as soon as its last handle is closed, so it must stay open here until the inference is done
+        blocks = []
+        decodes = {}
+        inferences = {}
+        results = dict.fromkeys(video_paths)
+        try:
+            for path in video_paths:
+                shape = (_max_frames(path, sampler), *self.img_shape)
+                block = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+                blocks.append(block)
+                decodes[self.executor.submit(_decode, path, crop, sampler, SharedFrames(block.name, shape))] = \
+                    (path, block.name)
+            for future in as_completed(decodes):
+                n_frames = future.result()
+                if n_frames > 0:
+                    path, name = decodes[future]
+                    shared = SharedFrames(name, (n_frames, *self.img_shape))
+                    inferences[self.executor.submit(_infer, shared)] = path
+            for future in as_completed(inferences):
+                results[inferences[future]] = future.result()
+        finally:
+            # Release the shared memory of every video, even after a failure, once no worker is using it anymore
+            wait(list(decodes) + list(inferences))
+            for block in blocks:
+                block.close()
+                block.unlink()
+        return results
+
+
+class ModelFile:
+    """
+    The model file used by the worker processes, with the attributes of classifiers.LoadedModel
+    that identify it in the result caches. The model itself is never loaded by this process.
+    """
+    def __init__(self, path, stamp):
+        self.path = path
+        self.stamp = stamp
+        self.digest = file_digest(path)
+
+
+class ProcessPoolClassifier(TFClassifier):
+    def __init__(self, model_path="model.hdf5", batch_size=16, max_frames=16, cache_path="cache/results.sqlite",
+                 sampler=None, n_workers=None):
+        """
+        TFClassifier.__init__ is not called: the model is loaded by the worker processes only.
+
+        :param model_path: path of the Keras model
+        :param batch_size: maximum number of frames that are sent to the model at once
+        :param max_frames: number of frames of each video that are classified by the default sampler
+        :param cache_path: path of the persistent result cache, None to disable it
+        :param sampler: the FrameSampler that chooses the frames to classify
+        :param n_workers: number of worker processes, by default one per core
+        """
+        self.img_shape = (224, 224, 3)
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.sampler = sampler if sampler is not None else FirstFramesSampler(max_frames)
+        self.cache = open_cache(cache_path) if cache_path is not None else None
+        self.engine = InferenceEngine.get(model_path, self.img_shape, batch_size, n_workers or os.cpu_count())
+        self._model_file = None
+
+    def warm_up(self):
+        self.engine.warm_up()
+        return self.load_model()
+
+    def load_model(self):
+        """ Returns the ModelFile of the model, hashed again only when it changes on disk """
+        path = os.path.abspath(self.model_path)
+        stat = os.stat(path)
+        stamp = stat.st_mtime_ns, stat.st_size
+        if self._model_file is None or self._model_file.path != path or self._model_file.stamp != stamp:
+            self._model_file = ModelFile(path, stamp)
+        return self._model_file
+
+    def classify_all(self, videos, crop, result, cancelled=None):
+        """
+        Classifies the videos in the worker processes, storing the VideoResult of each one in result.videos[file name].
+        Only the videos without a cached result are sent to the pool. The videos already submitted to the pool
+        are not interrupted, the cancellation is checked before and after.
+        """
+        if cancelled is not None and cancelled.is_set():
+            raise Cancelled(videos[0] if videos else "")
+        model_file = self.load_model()
+
+        # Without a crop, the videos are grouped by the crop rectangle stored next to them, if any
+        crops = {}
+        for video_path in videos:
+            video_crop = crop if crop is not None else read_crop_sidecar(video_path)
+            video_result = self.cached_result(model_file, video_path, video_crop)
+            if video_result is not None:
+                result.videos[os.path.basename(video_path)] = video_result
+            else:
+                crops.setdefault(tuple(video_crop) if video_crop is not None else None, []).append(video_path)
+        outputs = {}
+        for video_crop, paths in crops.items():
+            outputs[video_crop] = self.engine.classify_many(paths, video_crop, self.sampler)
+        if cancelled is not None and cancelled.is_set():
+            raise Cancelled(videos[0] if videos else "")
+
+        for video_crop, video_outputs in outputs.items():
+            for video_path, clf_output in video_outputs.items():
+                if clf_output is not None:
+                    video_result = VideoResult.from_output(clf_output)
+                    self.store_result(model_file, video_path, video_result,
+                                      list(video_crop) if video_crop is not None else None)
+                    result.videos[os.path.basename(video_path)] = video_result
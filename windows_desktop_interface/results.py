@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+"""
+This file contains the typed results produced by the classifiers.
+
+The results are plain Python objects with __slots__ and numpy arrays, so that they can be
+passed between the worker threads and the GUI through a pyqtSignal(object) as they are.
+JSON is only used to export them.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import json
+import numpy as np
+
+
+KEYS = [
+    'left-anterior-apical',
+    'left-anterior-basal',
+    'left-lateral-apical',
+    'left-lateral-basal',
+    'left-posterior-apical',
+    'left-posterior-medial',
+    'left-posterior-basal',
+    'right-anterior-apical',
+    'right-anterior-basal',
+    'right-lateral-apical',
+    'right-lateral-basal',
+    'right-posterior-apical',
+    'right-posterior-medial',
+    'right-posterior-basal',
+]
+KEY_INDEX = {key: i for i, key in enumerate(KEYS)}
+
+# Scores from 0 (healthy) to 3 (most severe), NOT_MEASURED for the areas not scored yet
+N_SEVERITIES = 4
+NOT_MEASURED = 4
+
+
+class VideoResult:
+    """
+    Result of the classification of a single video.
+
+    :param probabilities: the class probabilities of the video
+    :param timings: the StageTimings of the classification, None if the result was cached
+    """
+    __slots__ = ('label', 'probabilities', 'timings')
+
+    def __init__(self, probabilities, timings=None):
+        self.probabilities = np.asarray(probabilities, dtype=np.float32)
+        self.label = int(np.argmax(self.probabilities))
+        self.timings = timings
+
+    @classmethod
+    def from_output(cls, clf_output, timings=None):
+        """ Creates the result from the sum of the outputs of the frames of the video """
+        clf_output = np.asarray(clf_output, dtype=np.float32)
+        total = clf_output.sum()
+        return cls(clf_output / total if total > 0 else clf_output, timings)
+
+    def to_dict(self):
+        return {'label': self.label, 'probabilities': [round(float(p), 6) for p in self.probabilities]}
+
+    @classmethod
+    def from_dict(cls, value):
+        """ Returns the result stored with to_dict, or None if value has a different format """
+        if not isinstance(value, dict) or 'probabilities' not in value:
+            return None
+        return cls(value['probabilities'])
+
+
+class ExamResult:
+    """
+    Result of the classification of an exam: the score and the class probabilities of each
+    of the 14 areas, the confidence of the scores and the results of the videos that were classified.
+
+    The scores can be read by area name, e.g. result['left-anterior-apical'].
+    """
+    __slots__ = ('name', 'working_dir', 'scores', 'probabilities', 'confidence', 'videos', 'sources', 'error')
+
+    def __init__(self, name="", working_dir=""):
+        self.name = name
+        self.working_dir = working_dir
+        self.scores = np.full(len(KEYS), NOT_MEASURED, dtype=np.int8)
+        # 14 x N_SEVERITIES matrix, the rows of the areas not measured are zero
+        self.probabilities = np.zeros((len(KEYS), N_SEVERITIES), dtype=np.float32)
+        self.confidence = 0.0
+        # File name of each video -> VideoResult
+        self.videos = {}
+        # Area -> (path of the video it was scored from, crop rectangle or None)
+        self.sources = {}
+        # Traceback of the exception that stopped the classification, if any
+        self.error = None
+
+    @classmethod
+    def failed(cls, error):
+        result = cls()
+        result.error = error
+        return result
+
+    def __getitem__(self, key):
+        return int(self.scores[KEY_INDEX[key]])
+
+    def __setitem__(self, key, score):
+        self.scores[KEY_INDEX[key]] = score
+
+    def counts(self):
+        """ Returns the number of areas with each score, the last one being NOT_MEASURED """
+        return np.bincount(self.scores, minlength=NOT_MEASURED + 1)
+
+    @property
+    def pathological_areas(self):
+        return int(np.count_nonzero((self.scores > 0) & (self.scores != NOT_MEASURED)))
+
+    @property
+    def timings(self):
+        return {file: video.timings for file, video in self.videos.items() if video.timings is not None}
+
+    def to_dict(self):
+        """ Returns the result in the format of the exported JSON """
+        output = {'name': self.name, 'working_dir': self.working_dir}
+        for file, video in self.videos.items():
+            output[file] = str(video.label)
+        output['timings'] = {file: timings.to_dict() for file, timings in self.timings.items()}
+        output['probabilities'] = {file: video.to_dict()['probabilities'] for file, video in self.videos.items()}
+        output.update({key: int(score) for key, score in zip(KEYS, self.scores)})
+
+        counts = self.counts()
+        output['pathological_areas'] = self.pathological_areas
+        for score in range(N_SEVERITIES):
+            output['n_score_{}'.format(score)] = int(counts[score])
+        output['n_not_measured'] = int(counts[NOT_MEASURED])
+        output['confidence'] = round(float(self.confidence), 6)
+        if self.error is not None:
+            output['error'] = self.error
+        return output
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
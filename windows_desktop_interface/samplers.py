@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+"""
+This file contains the strategies used to choose which frames of a video are classified
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import os
+import subprocess
+import numpy as np
+
+
+class FrameSampler:
+    """ Interface for the frame samplers """
+    name = ""
+
+    def frames(self, cap, stats, video_path=None):
+        """
+        Generator of the frames to classify.
+
+        :param cap: an opened cv2.VideoCapture
+        :param stats: object whose 'decoded' counter is incremented for every decoded frame
+        :param video_path: path of the video, for the samplers that need to inspect the file
+        """
+        raise NotImplementedError("This method must be implemented by the extending class")
+
+    def params(self):
+        """ Returns the parameters of the sampler, used e.g. as part of the cache keys """
+        return {'sampler': self.name}
+
+
+def _frame_count(cap):
+    import cv2
+    return int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+
+def _read_indices(cap, indices, stats, max_skip=8):
+    """
+    Reads the frames at the given (sorted) indices. Short gaps are skipped with grab(),
+    which does not convert the frame, longer ones by seeking.
+    """
+    import cv2
+    position = 0
+    for index in indices:
+        if index < position or index - position > max_skip:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        else:
+            while position < index:
+                if not cap.grab():
+                    return
+                stats.decoded += 1
+                position += 1
+        ok, frame = cap.read()
+        if not ok or frame is None:
+            return
+        stats.decoded += 1
+        position = index + 1
+        yield frame
+
+
+class FirstFramesSampler(FrameSampler):
+    """ Classifies the first n frames of the video """
+    name = "first"
+
+    def __init__(self, n_frames=16):
+        self.n_frames = n_frames
+
+    def frames(self, cap, stats, video_path=None):
+        for _ in range(self.n_frames):
+            ok, frame = cap.read()
+            if not ok or frame is None:
+                return
+            stats.decoded += 1
+            yield frame
+
+    def params(self):
+        return {'sampler': self.name, 'n_frames': self.n_frames}
+
+
+class UniformSampler(FrameSampler):
+    """ Classifies n frames evenly spaced over the whole video """
+    name = "uniform"
+
+    def __init__(self, n_frames=16):
+        self.n_frames = n_frames
+
+    def frames(self, cap, stats, video_path=None):
+        count = _frame_count(cap)
+        if count <= 0:
+            # Unknown length, e.g. for some containers: fall back to the first frames
+            yield from FirstFramesSampler(self.n_frames).frames(cap, stats)
+            return
+        indices = np.unique(np.linspace(0, count - 1, min(self.n_frames, count)).round().astype(int))
+        yield from _read_indices(cap, indices, stats)
+
+    def params(self):
+        return {'sampler': self.name, 'n_frames': self.n_frames}
+
+
+class StrideSampler(FrameSampler):
+    """ Classifies one frame every stride, up to n frames (all of them if n_frames is None) """
+    name = "stride"
+
+    def __init__(self, stride=5, n_frames=16):
+        self.stride = stride
+        self.n_frames = n_frames
+
+    def frames(self, cap, stats, video_path=None):
+        used = 0
+        while self.n_frames is None or used < self.n_frames:
+            if used > 0:
+                # Skip the frames between two sampled ones without converting them
+                for _ in range(self.stride - 1):
+                    if not cap.grab():
+                        return
+                    stats.decoded += 1
+            ok, frame = cap.read()
+            if not ok or frame is None:
+                return
+            stats.decoded += 1
+            used += 1
+            yield frame
+
+    def params(self):
+        return {'sampler': self.name, 'stride': self.stride, 'n_frames': self.n_frames}
+
+
+class KeyframeSampler(FrameSampler):
+    """
+    Classifies up to n keyframes evenly spaced over the video. Seeking to a keyframe
+    decodes only that frame, so this is the cheapest way to cover long clips.
+
+    The keyframes are listed with ffprobe; if it is not available, the sampler falls
+    back to uniform sampling.
+    """
+    name = "keyframe"
+
+    def __init__(self, n_frames=16, ffprobe_bin=None):
+        self.n_frames = n_frames
+        self.ffprobe_bin = ffprobe_bin if ffprobe_bin is not None else os.getcwd() + "/bin/ffprobe"
+
+    def keyframe_times(self, video_path):
+        """ Returns the timestamps (in seconds) of the keyframes of a video, or None on failure """
+        command = [
+            self.ffprobe_bin, '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+            '-show_entries', 'frame=best_effort_timestamp_time', '-of', 'csv=p=0', video_path
+        ]
+        try:
+            output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        times = []
+        for line in output.decode().split():
+            try:
+                times.append(float(line.strip(",")))
+            except ValueError:
+                pass
+        return times
+
+    def frames(self, cap, stats, video_path=None):
+        import cv2
+        times = self.keyframe_times(video_path) if video_path is not None else None
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if not times or fps <= 0:
+            yield from UniformSampler(self.n_frames).frames(cap, stats)
+            return
+
+        keyframes = np.unique(np.round(np.asarray(times) * fps).astype(int))
+        chosen = keyframes[np.unique(np.linspace(0, len(keyframes) - 1, min(self.n_frames, len(keyframes))).round().astype(int))]
+        for index in chosen:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ok, frame = cap.read()
+            if not ok or frame is None:
+                return
+            stats.decoded += 1
+            yield frame
+
+    def params(self):
+        return {'sampler': self.name, 'n_frames': self.n_frames}
+
+
+class AllFramesSampler(FrameSampler):
+    """ Classifies every frame of the video, meant for offline runs """
+    name = "all"
+
+    def frames(self, cap, stats, video_path=None):
+        while True:
+            ok, frame = cap.read()
+            if not ok or frame is None:
+                return
+            stats.decoded += 1
+            yield frame
+
+
+SAMPLERS = {
+    FirstFramesSampler.name: FirstFramesSampler,
+    UniformSampler.name: UniformSampler,
+    StrideSampler.name: StrideSampler,
+    KeyframeSampler.name: KeyframeSampler,
+    AllFramesSampler.name: AllFramesSampler,
+}
+
+
+def make_sampler(name, **kwargs):
+    """ Builds a sampler from its name, e.g. make_sampler("uniform", n_frames=32) """
+    if name not in SAMPLERS:
+        raise ValueError("Unknown sampler '{}', available: {}".format(name, ", ".join(SAMPLERS)))
+    return SAMPLERS[name](**kwargs)
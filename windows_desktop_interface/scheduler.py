@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+"""
+This file contains the scheduler of the background jobs of the interface.
+
+Every resource (e.g. the CPU used by the inference, the ffmpeg encodes) has its own thread
+pool with its own concurrency cap. Inside a pool the interactive jobs run ahead of the
+background ones. A job can be submitted with a key: a newer job with the same key (e.g.
+the classification of the same area) supersedes the older one, which is cancelled and
+whose results are never delivered.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import threading
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+# Resources
+CPU = "cpu"
+FFMPEG = "ffmpeg"
+
+# Priorities, the higher runs first
+INTERACTIVE = 10
+BACKGROUND = 0
+
+
+class JobSignals(QObject):
+    finished = pyqtSignal(object)  # the job, emitted once whether it ran or was cancelled
+
+
+class _Delivery(QObject):
+    """ Forwards the results of a job unless it was cancelled, in the thread of the receiver """
+    def __init__(self, job, slot):
+        super(_Delivery, self).__init__()
+        self.job = job
+        self.slot = slot
+
+    def forward(self, *args):
+        if not self.job.cancelled.is_set():
+            self.slot(*args)
+
+
+class Job(QRunnable):
+    """
+    Base class of the jobs of the JobScheduler. Subclasses implement execute(), which should
+    check self.cancelled from time to time and return early when it is set.
+    """
+    def __init__(self):
+        super(Job, self).__init__()
+        # The scheduler keeps the job alive until it is finished, Qt must not delete it
+        self.setAutoDelete(False)
+        self.cancelled = threading.Event()
+        self.key = None
+        self.job_signals = JobSignals()
+        self._deliveries = []
+
+    def run(self):
+        try:
+            if not self.cancelled.is_set():
+                self.execute()
+        finally:
+            self.job_signals.finished.emit(self)
+
+    def execute(self):
+        raise NotImplementedError("This method must be implemented by the extending class")
+
+
+class JobScheduler(QObject):
+    """
+    Runs the jobs on a thread pool per resource.
+
+    :param limits: dictionary mapping each resource to its maximum number of concurrent jobs
+    """
+    def __init__(self, limits, parent=None):
+        super(JobScheduler, self).__init__(parent)
+        self.pools = {}
+        for resource, max_threads in limits.items():
+            pool = QThreadPool(self)
+            pool.setMaxThreadCount(max_threads)
+            self.pools[resource] = pool
+        self._current = {}  # key -> job
+        self._jobs = set()  # jobs submitted and not finished yet
+
+    def submit(self, job, resource=CPU, priority=INTERACTIVE, key=None):
+        """ Queues a job; if key is given, the previous job with the same key is cancelled """
+        if key is not None:
+            self.cancel(key)
+            self._current[key] = job
+        job.key = key
+        job.job_signals.finished.connect(self._finished)
+        self._jobs.add(job)
+        self.pools[resource].start(job, priority)
+        return job
+
+    def deliver(self, job, slot):
+        """
+        Returns a slot that forwards the results of job to slot, unless the job has been cancelled
+        in the meantime, e.g. job.signals.result.connect(scheduler.deliver(job, self.process_result)).
+        Must be called from the thread of the receiver, e.g. the GUI thread, where the check runs.
+        """
+        delivery = _Delivery(job, slot)
+        job._deliveries.append(delivery)
+        return delivery.forward
+
+    def cancel(self, key):
+        """ Cancels the current job with the given key, if any """
+        job = self._current.pop(key, None)
+        if job is not None:
+            self.cancel_job(job)
+
+    def cancel_job(self, job):
+        """ Cancels a job. Returns True if it had not started yet, and therefore will never run """
+        job.cancelled.set()
+        if job.key is not None and self._current.get(job.key) is job:
+            del self._current[job.key]
+        for pool in self.pools.values():
+            if pool.tryTake(job):
+                job.job_signals.finished.emit(job)
+                return True
+        return False
+
+    def cancel_all(self):
+        for job in list(self._jobs):
+            self.cancel_job(job)
+
+    def _finished(self, job):
+        self._jobs.discard(job)
+        if job.key is not None and self._current.get(job.key) is job:
+            del self._current[job.key]
+
+    def wait_for_done(self, msecs=-1):
+        """ Waits for the running jobs of all the pools """
+        return all(pool.waitForDone(msecs) for pool in self.pools.values())
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+"""
+This file contains the persistent store of patients, exams and per-area scores.
+
+The data is kept in an embedded SQLite database, indexed on the patient name, the date
+of acquisition and the scores, so that past exams can be reopened or searched without
+recomputing anything.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL COLLATE NOCASE,
+    surname TEXT NOT NULL COLLATE NOCASE,
+    date_of_birth TEXT NOT NULL,
+    UNIQUE (surname, name, date_of_birth)
+);
+CREATE TABLE IF NOT EXISTS exams (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER REFERENCES patients (id),
+    date_of_acquisition TEXT NOT NULL DEFAULT '',
+    notes TEXT NOT NULL DEFAULT '',
+    pathological_areas INTEGER NOT NULL DEFAULT 0,
+    max_score INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS area_scores (
+    exam_id INTEGER NOT NULL REFERENCES exams (id) ON DELETE CASCADE,
+    area TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    video_path TEXT NOT NULL DEFAULT '',
+    crop TEXT,
+    PRIMARY KEY (exam_id, area)
+);
+CREATE INDEX IF NOT EXISTS patients_name ON patients (surname, name);
+CREATE INDEX IF NOT EXISTS exams_patient ON exams (patient_id);
+CREATE INDEX IF NOT EXISTS exams_date_of_acquisition ON exams (date_of_acquisition);
+CREATE INDEX IF NOT EXISTS exams_max_score ON exams (max_score);
+CREATE INDEX IF NOT EXISTS area_scores_score ON area_scores (score);
+"""
+
+# Scores from 1 to 3 are pathological, 4 means not measured
+PATHOLOGICAL_SCORES = (1, 2, 3)
+
+
+def check_date(date):
+    """
+    Returns a date in ISO format (e.g. "2020-03-17", see QDate.toString(Qt.ISODate)), so that it sorts
+    correctly, or an empty string if it is unknown. Raises ValueError for any other format.
+    """
+    if not date:
+        return ""
+    datetime.strptime(date, "%Y-%m-%d")
+    return date
+
+
+class PatientStore:
+    """
+    SQLite-backed store of the patients and of their exams.
+
+    :param path: path of the database
+    """
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _patient_id(self, name, surname, date_of_birth):
+        values = (name, surname, check_date(date_of_birth))
+        row = self._conn.execute(
+            "SELECT id FROM patients WHERE name = ? AND surname = ? AND date_of_birth = ?", values).fetchone()
+        if row is not None:
+            return row['id']
+        return self._conn.execute(
+            "INSERT INTO patients (name, surname, date_of_birth) VALUES (?, ?, ?)", values).lastrowid
+
+    def create_exam(self, name="", surname="", date_of_birth="", date_of_acquisition="", notes=""):
+        """
+        Creates a new exam, together with its patient if needed, and returns the id of the exam.
+        The dates are in ISO format, see check_date.
+        """
+        with self._lock, self._conn:
+            patient_id = self._patient_id(name, surname, date_of_birth)
+            return self._conn.execute(
+                "INSERT INTO exams (patient_id, date_of_acquisition, notes, updated) VALUES (?, ?, ?, ?)",
+                (patient_id, check_date(date_of_acquisition), notes, time.time())).lastrowid
+
+    def update_exam(self, exam_id, name, surname, date_of_birth, date_of_acquisition, notes):
+        """ Updates the patient data and the notes of an exam """
+        with self._lock, self._conn:
+            patient_id = self._patient_id(name, surname, date_of_birth)
+            self._conn.execute(
+                "UPDATE exams SET patient_id = ?, date_of_acquisition = ?, notes = ?, updated = ? WHERE id = ?",
+                (patient_id, check_date(date_of_acquisition), notes, time.time(), exam_id))
+
+    def save_area(self, exam_id, area, score, video_path="", crop=None):
+        """ Stores the score of an area and updates the totals of the exam in the same transaction """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO area_scores (exam_id, area, score, video_path, crop) VALUES (?, ?, ?, ?, ?)",
+                (exam_id, area, score, video_path, json.dumps(crop) if crop is not None else None))
+            self._conn.execute(
+                "UPDATE exams SET "
+                "pathological_areas = (SELECT COUNT(*) FROM area_scores WHERE exam_id = ? AND score IN (?, ?, ?)), "
+                "max_score = (SELECT COALESCE(MAX(score), 0) FROM area_scores WHERE exam_id = ? AND score IN (?, ?, ?)), "
+                "updated = ? WHERE id = ?",
+                (exam_id, *PATHOLOGICAL_SCORES, exam_id, *PATHOLOGICAL_SCORES, time.time(), exam_id))
+
+    def delete_exam(self, exam_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM exams WHERE id = ?", (exam_id,))
+
+    def load_exam(self, exam_id):
+        """ Returns an exam as a dictionary, with its areas under 'areas', or None if it does not exist """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT exams.*, patients.name, patients.surname, patients.date_of_birth "
+                "FROM exams JOIN patients ON patients.id = exams.patient_id WHERE exams.id = ?", (exam_id,)).fetchone()
+            if row is None:
+                return None
+            exam = dict(row)
+            exam['areas'] = {
+                area['area']: {
+                    'score': area['score'],
+                    'video_path': area['video_path'],
+                    'crop': json.loads(area['crop']) if area['crop'] is not None else None,
+                }
+                for area in self._conn.execute("SELECT * FROM area_scores WHERE exam_id = ?", (exam_id,))
+            }
+        return exam
+
+    def find_exams(self, surname=None, name=None, date_from=None, date_to=None, min_score=None, limit=100):
+        """
+        Searches the exams, the most recent first. All the criteria are optional.
+
+        :param surname, name: prefixes of the names of the patient
+        :param date_from, date_to: range of the date of acquisition
+        :param min_score: minimum score of the worst area
+        """
+        conditions = []
+        values = []
+        if surname:
+            conditions.append("patients.surname LIKE ?")
+            values.append(surname + "%")
+        if name:
+            conditions.append("patients.name LIKE ?")
+            values.append(name + "%")
+        if date_from:
+            conditions.append("exams.date_of_acquisition >= ?")
+            values.append(check_date(date_from))
+        if date_to:
+            conditions.append("exams.date_of_acquisition <= ?")
+            values.append(check_date(date_to))
+        if min_score is not None:
+            conditions.append("exams.max_score >= ?")
+            values.append(min_score)
+
+        query = ("SELECT exams.id, patients.name, patients.surname, patients.date_of_birth, "
+                 "exams.date_of_acquisition, exams.pathological_areas, exams.max_score "
+                 "FROM exams JOIN patients ON patients.id = exams.patient_id")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY exams.date_of_acquisition DESC, exams.id DESC LIMIT ?"
+
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, values + [limit])]
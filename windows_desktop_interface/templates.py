@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+"""
+This file contains the precompiled HTML templates used for the reports.
+
+A template is parsed once into a list of literal chunks and typed slots, so that
+rendering it is a single join instead of a chain of str.replace over the whole page.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import re
+import html
+import functools
+
+
+# Slot types: the value of a TEXT slot is escaped, the one of a RAW slot is inserted as it is
+TEXT = "text"
+RAW = "raw"
+
+# Markers that are removed from the rendered output
+REMOVED_MARKERS = ["<!--EDITME", "EDITME-->"]
+
+
+class Template:
+    """
+    A template with named placeholders.
+
+    :param source: the source of the template
+    :param slots: dictionary mapping each placeholder (e.g. "_name") to its type, TEXT or RAW
+    """
+    def __init__(self, source, slots):
+        if len(source) == 0:
+            raise RuntimeError("The HTML template must not be empty")
+
+        self.slots = dict(slots)
+        for marker in REMOVED_MARKERS:
+            source = source.replace(marker, "")
+
+        # The longest placeholders come first and a placeholder must not be followed by
+        # a name character, so that "_n" can never match inside "_name"
+        names = sorted(self.slots, key=len, reverse=True)
+        pattern = re.compile("(" + "|".join(re.escape(name) for name in names) + r")(?![\w-])")
+
+        # Even positions are literal chunks, odd positions are slot names
+        self._parts = pattern.split(source) if names else [source]
+
+    def render(self, values, missing=None):
+        """
+        Renders the template.
+
+        :param values: dictionary mapping the placeholders to their values
+        :param missing: value used for the placeholders not in values, None to keep the placeholder
+        """
+        parts = self._parts[:]
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            if name in values:
+                value = str(values[name])
+                parts[i] = html.escape(value) if self.slots[name] == TEXT else value
+            elif missing is not None:
+                parts[i] = missing
+        return "".join(parts)
+
+    def render_many(self, values_list, missing=None):
+        """ Renders the template once for each dictionary of values """
+        return [self.render(values, missing) for values in values_list]
+
+
+@functools.lru_cache(maxsize=None)
+def load_template(filename, slots):
+    """
+    Returns the Template stored in filename, parsed only at the first call.
+
+    :param slots: tuple of (placeholder, type) pairs
+    """
+    with open(filename) as file:
+        return Template(file.read(), dict(slots))
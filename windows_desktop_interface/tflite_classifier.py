@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+"""
+This file contains an implementation of the Classifier interface running a TensorFlow Lite
+version of the Keras model, optionally quantized.
+
+The model is converted once and the result is stored next to the original (e.g.
+model.hdf5 -> model.int8.tflite); it is converted again only when the original changes.
+The int8 quantization is calibrated on frames sampled from a set of sample videos.
+
+Running this file compares the converted model with TFClassifier on a set of videos:
+
+Usage: python tflite_classifier.py VIDEO [VIDEO ...] [--quantization int8] [--calibration VIDEO ...]
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+import threading
+import numpy as np
+from cache import file_digest
+from classifiers import TFClassifier
+from pipeline import StageTimings
+from samplers import UniformSampler
+from aggregate import severity_probabilities
+
+
+QUANTIZATIONS = ("none", "dynamic", "int8")
+
+
+def _interpreter_class():
+    """ The standalone TFLite runtime is used when installed, so that TensorFlow is not even imported """
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+def artifact_path(model_path, quantization):
+    """ Path of the converted model, stored next to the original """
+    return "{}.{}.tflite".format(os.path.splitext(model_path)[0], quantization)
+
+
+def calibration_frames(video_paths, img_shape, n_frames=8):
+    """ Yields batches of a single frame, sampled evenly from each video and resized as in FramePipeline """
+    import cv2
+    sampler = UniformSampler(n_frames)
+    for video_path in video_paths:
+        cap = cv2.VideoCapture(video_path)
+        try:
+            for frame in sampler.frames(cap, StageTimings(), video_path):
+                frame = cv2.resize(frame, (img_shape[1], img_shape[0]))
+                yield frame[np.newaxis].astype(np.float32)
+        finally:
+            cap.release()
+
+
+def convert_model(model_path, output_path, quantization="dynamic", calibration_videos=(), img_shape=(224, 224, 3)):
+    """
+    Converts a Keras model to TFLite.
+
+    :param quantization: "none", "dynamic" (weights in int8) or "int8" (weights and activations in int8)
+    :param calibration_videos: videos whose frames calibrate the ranges of the activations, needed by "int8"
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError("Unknown quantization {}, expected one of {}".format(quantization, QUANTIZATIONS))
+
+    import tensorflow as tf
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "int8":
+        frames = list(calibration_frames(calibration_videos, img_shape))
+        if len(frames) == 0:
+            raise ValueError("The int8 quantization needs at least one calibration video")
+        converter.representative_dataset = lambda: ([frame] for frame in frames)
+    content = converter.convert()
+
+    # Write and rename, so that a half-written file is never loaded
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(content)
+    os.replace(tmp_path, output_path)
+    print("Model converted: {}".format(output_path))
+
+
+def prepare_model(model_path, quantization, calibration_videos=(), img_shape=(224, 224, 3)):
+    """ Converts the model if the converted one is missing or older than the original, returns its path """
+    model_path = os.path.abspath(model_path)
+    path = artifact_path(model_path, quantization)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(model_path):
+        convert_model(model_path, path, quantization, calibration_videos, img_shape)
+    return path
+
+
+class LiteModel:
+    """ A converted model, with the same interface of classifiers.LoadedModel """
+    def __init__(self, path, stamp, num_threads=None):
+        self.path = path
+        self.stamp = stamp
+        self.digest = file_digest(path)
+        self.lock = threading.Lock()
+        # num_threads is not accepted by older interpreters, e.g. tf.lite.Interpreter of TensorFlow 2.1
+        options = {'num_threads': num_threads} if num_threads is not None else {}
+        self.interpreter = _interpreter_class()(model_path=path, **options)
+        self._input = self.interpreter.get_input_details()[0]['index']
+        self._output = self.interpreter.get_output_details()[0]['index']
+        self._batch_size = None
+
+    def predict(self, batch):
+        """ Runs a forward pass on a batch of frames and returns the outputs as a numpy array """
+        batch = np.asarray(batch, dtype=np.float32)
+        with self.lock:
+            # The tensors are allocated again only when the size of the batch changes
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input, batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self._input, batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output).copy()
+
+
+class LiteModelRegistry:
+    """ Process-wide registry of the converted models, see classifiers.ModelRegistry """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def get(self, model_path, quantization, calibration_videos, input_shape, num_threads=None):
+        """ Returns the LiteModel of the given Keras model, converting it if needed """
+        with self._lock:
+            path = prepare_model(model_path, quantization, calibration_videos, input_shape)
+            stat = os.stat(path)
+            stamp = stat.st_mtime_ns, stat.st_size
+
+            entry = self._models.get(path)
+            if entry is None or entry.stamp != stamp:
+                entry = LiteModel(path, stamp, num_threads)
+                entry.predict(np.zeros((1, *input_shape), dtype=np.float32))
+                print("Model loaded: {}".format(path))
+                self._models[path] = entry
+            return entry
+
+    def unload(self):
+        with self._lock:
+            self._models.clear()
+
+
+LITE_REGISTRY = LiteModelRegistry()
+
+
+class TFLiteClassifier(TFClassifier):
+    def __init__(self, model_path="model.hdf5", quantization="dynamic", calibration_videos=(), num_threads=None, **kwargs):
+        """
+        :param model_path: path of the Keras model, converted at the first use
+        :param quantization: "none", "dynamic" or "int8", see convert_model
+        :param calibration_videos: sample videos used to calibrate the int8 quantization
+        :param num_threads: number of threads of the interpreter, None for the default
+        :param kwargs: the other parameters of TFClassifier
+        """
+        self.quantization = quantization
+        self.calibration_videos = list(calibration_videos)
+        self.num_threads = num_threads
+        super(TFLiteClassifier, self).__init__(model_path=model_path, **kwargs)
+
+    def load_model(self):
+        return LITE_REGISTRY.get(self.model_path, self.quantization, self.calibration_videos,
+                                 self.img_shape, self.num_threads)
+
+
+def _rss_mb():
+    """ Resident memory of the process in MB, None if it cannot be measured """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _profile(classifier, video_paths):
+    """ Creates a classifier, which loads its model, and classifies the videos bypassing the result caches """
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    classifier = classifier()
+    load_time = time.perf_counter() - start
+    rss_after = _rss_mb()
+    loaded = classifier.load_model()
+
+    outputs = {}
+    latencies = []
+    for video_path in video_paths:
+        start = time.perf_counter()
+        clf_output, timings = classifier.classify_video(loaded, video_path)
+        latencies.append(time.perf_counter() - start)
+        outputs[video_path] = clf_output
+
+    return outputs, {
+        'model_file': loaded.path,
+        'model_size_mb': os.path.getsize(loaded.path) / 2 ** 20,
+        'load_time_s': load_time,
+        'memory_growth_mb': rss_after - rss_before if rss_before is not None else None,
+        'latency_mean_s': float(np.mean(latencies)) if latencies else None,
+        'latency_max_s': float(np.max(latencies)) if latencies else None,
+    }
+
+
+def compare(reference, candidate, video_paths):
+    """
+    Compares two classifiers on the same videos: loading time, memory, latency per video and
+    agreement of the predictions. The reference is loaded first, so its memory includes the runtime.
+
+    :param reference, candidate: callables creating the classifiers, e.g. TFClassifier
+    """
+    reference_outputs, reference_stats = _profile(reference, video_paths)
+    candidate_outputs, candidate_stats = _profile(candidate, video_paths)
+
+    same_label = same_score = n_videos = 0
+    max_difference = 0.0
+    for video_path in video_paths:
+        a, b = reference_outputs[video_path], candidate_outputs[video_path]
+        if a is None or b is None:
+            continue
+        n_videos += 1
+        same_label += int(np.argmax(a) == np.argmax(b))
+        a, b = severity_probabilities(a), severity_probabilities(b)
+        same_score += int(np.argmax(a) == np.argmax(b))
+        max_difference = max(max_difference, float(np.abs(a - b).max()))
+
+    return {
+        'reference': reference_stats,
+        'candidate': candidate_stats,
+        'videos': n_videos,
+        'label_agreement': same_label / n_videos if n_videos else None,
+        'score_agreement': same_score / n_videos if n_videos else None,
+        'max_severity_probability_difference': max_difference,
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Compares the TFLite version of the model with TFClassifier")
+    parser.add_argument("videos", nargs="+", help="videos used for the comparison")
+    parser.add_argument("--model", default="model.hdf5", help="path of the Keras model")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="dynamic")
+    parser.add_argument("--calibration", nargs="*", default=None,
+                        help="calibration videos of the int8 quantization (default: the compared videos)")
+    parser.add_argument("--threads", type=int, default=None, help="threads of the TFLite interpreter")
+    parser.add_argument("--reconvert", action="store_true", help="converts the model even if it is up to date")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    calibration = args.calibration if args.calibration is not None else args.videos
+    if args.reconvert and os.path.exists(artifact_path(os.path.abspath(args.model), args.quantization)):
+        os.remove(artifact_path(os.path.abspath(args.model), args.quantization))
+
+    reference = functools.partial(TFClassifier, model_path=args.model, cache_path=None)
+    candidate = functools.partial(TFLiteClassifier, model_path=args.model, quantization=args.quantization,
+                                  calibration_videos=calibration, num_threads=args.threads, cache_path=None)
+    print(json.dumps(compare(reference, candidate, args.videos), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+"""
+This file contains the instrumentation of the scoring workflow: named spans and counters.
+
+When the tracer is disabled (the default) a span is a shared object that does nothing, so
+the instrumented code pays only for a function call. When it is enabled, with
+LUNG_TRACE=1 in the environment or with TRACER.enable(), the spans are recorded as Chrome
+trace events (open the exported file in chrome://tracing or https://ui.perfetto.dev) and the
+latest durations of every span are kept for a rolling summary.
+
+Copyright: University of Trento
+
+Date: 18/10/2026
+"""
+import os
+import json
+import time
+import functools
+import threading
+import collections
+import numpy as np
+
+
+class _NullSpan:
+    """ Span used when the tracer is disabled """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add_span(self.name, self.start, time.perf_counter() - self.start, self.args)
+        return False
+
+
+class Tracer:
+    """
+    Collects the spans and the counters of the process.
+
+    :param enabled: whether the events are recorded
+    :param max_events: maximum number of events kept for the export, the oldest are dropped
+    :param window: number of recent durations of each span kept for the summary
+    """
+    def __init__(self, enabled=False, max_events=200000, window=200):
+        self.enabled = enabled
+        self.window = window
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._events = collections.deque(maxlen=max_events)
+        self._durations = {}
+        self._counters = collections.Counter()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def span(self, name, **args):
+        """ Context manager measuring the enclosed block, e.g. with TRACER.span("decode"): ... """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def add_span(self, name, start, duration, args=None):
+        """
+        Records a span measured by the caller.
+
+        :param start: time.perf_counter() at the start of the span
+        :param duration: duration in seconds
+        """
+        if not self.enabled:
+            return
+        event = {'name': name, 'ph': "X", 'ts': (start - self._origin) * 1e6, 'dur': duration * 1e6,
+                 'pid': os.getpid(), 'tid': threading.get_ident()}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+            if name not in self._durations:
+                self._durations[name] = collections.deque(maxlen=self.window)
+            self._durations[name].append(duration)
+
+    def count(self, name, value=1):
+        """ Increments a counter """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] += value
+            self._events.append({'name': name, 'ph': "C", 'ts': (time.perf_counter() - self._origin) * 1e6,
+                                 'pid': os.getpid(), 'args': {name: self._counters[name]}})
+
+    def summary(self):
+        """ Returns {span: {count, mean, p50, p90, max}} over the recent durations (in ms) and the counters """
+        with self._lock:
+            durations = {name: np.array(values) * 1000 for name, values in self._durations.items()}
+            counters = dict(self._counters)
+        spans = {
+            name: {'count': len(values), 'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)),
+                   'p90': float(np.percentile(values, 90)), 'max': float(values.max())}
+            for name, values in durations.items()
+        }
+        return {'spans': spans, 'counters': counters}
+
+    def format_summary(self):
+        """ Returns the summary as a text table """
+        summary = self.summary()
+        lines = ["{:<24} {:>6} {:>9} {:>9} {:>9} {:>9}".format("span (ms)", "n", "mean", "p50", "p90", "max")]
+        for name, stats in sorted(summary['spans'].items()):
+            lines.append("{:<24} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                name, stats['count'], stats['mean'], stats['p50'], stats['p90'], stats['max']))
+        for name, value in sorted(summary['counters'].items()):
+            lines.append("{:<24} {:>6}".format(name, value))
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path):
+        """ Writes the recorded events in the Chrome trace format """
+        with self._lock:
+            events = list(self._events)
+        with open(path, "w") as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': "ms"}, file)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._durations.clear()
+            self._counters.clear()
+
+
+TRACER = Tracer(enabled=os.environ.get("LUNG_TRACE") == "1")
+
+
+def traced(name):
+    """ Decorator recording every call of a function as a span """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            with TRACER.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -12,9 +12,11 @@ import json
 import pdfkit
 import sys
 from datetime import datetime
-from PyQt5.QtCore import QEventLoop, QDate, pyqtSignal
+from PyQt5.QtCore import QEventLoop, QDate, Qt, pyqtSignal
 from PyQt5.QtWidgets import QDialog, QVBoxLayout, QCalendarWidget, QWidget, QPushButton, QLabel
 from PyQt5.QtWebEngineWidgets import QWebEngineView
+from templates import Template, load_template, TEXT, RAW
+from results import KEYS
 
 COLORS = {
     0: "white",
@@ -24,22 +26,12 @@ COLORS = {
     4: "grey", 
 }
 
-KEYS = [
-    'left-anterior-apical',
-    'left-anterior-basal',
-    'left-lateral-apical',
-    'left-lateral-basal',
-    'left-posterior-apical',
-    'left-posterior-medial',
-    'left-posterior-basal',
-    'right-anterior-apical',
-    'right-anterior-basal',
-    'right-lateral-apical',
-    'right-lateral-basal',
-    'right-posterior-apical',
-    'right-posterior-medial',
-    'right-posterior-basal',
-]
+# Placeholders of the patient data in the report template
+PATIENT_FIELDS = ['_name', '_surname', '_dob', '_doa', '_pathological_areas',
+                  '_n_white', '_n_yellow', '_n_orange', '_n_red', '_n_grey', '_notes']
+
+# The colors of the areas are inserted as they are, the patient data is escaped
+REPORT_SLOTS = tuple([("_" + key, RAW) for key in KEYS] + [(field, TEXT) for field in PATIENT_FIELDS])
 
 
 
@@ -54,6 +46,30 @@ class ClickableQLabel(QLabel):
         self.clicked.emit()
 
 
+class DateLabel(ClickableQLabel):
+    """ Clickable label showing a date, which keeps the QDate so that it can be stored independently of the locale """
+    def __init__(self, parent=None):
+        ClickableQLabel.__init__(self, parent=parent)
+        self.date = None
+
+    def setDate(self, qDate):
+        """ Shows a QDate, an invalid or None QDate clears the label """
+        self.date = qDate if qDate is not None and qDate.isValid() else None
+        self.setText(format_date(self.date) if self.date is not None else "")
+
+    def isoDate(self):
+        """ Returns the date in ISO format (e.g. "2020-03-17"), an empty string if no date was selected """
+        return self.date.toString(Qt.ISODate) if self.date is not None else ""
+
+    def setIsoDate(self, date):
+        self.setDate(QDate.fromString(date, Qt.ISODate) if date else None)
+
+
+def format_date(qDate):
+    """ Returns the date as shown in the interface, e.g. "17 Mar 2020", with the month name of the Qt locale """
+    return '{0} {1} {2}'.format(qDate.day(), qDate.longMonthName(qDate.month())[:3].capitalize(), qDate.year())
+
+
 
 
 class Calendar(QDialog):
@@ -94,7 +110,8 @@ class Calendar(QDialog):
         print(f'Day Number of the week: {qDate.dayOfWeek()}')
 
     def setDate(self, qDate):
-        self.selectedDate = '{0} {1} {2}'.format(qDate.day(), qDate.longMonthName(qDate.month())[:3].capitalize(), qDate.year())
+        self.selectedQDate = qDate
+        self.selectedDate = format_date(qDate)
 
     def getDate(self):
         return self.selectedDate
@@ -105,41 +122,58 @@ def customize_report(filename, json_dict):
     This function customizes the report with the values specified in the passed JSON.
     Returns a string containing the customized HTML source
     """
-    html = ""
+    patient = json.loads(json_dict)
+    template = load_template(filename, REPORT_SLOTS)
+    return template.render(area_values(patient))
 
-    with open(filename) as file:
-        html = "".join(file.readlines())
 
-    if len(html) == 0:
-        raise RuntimeError("The HTML template must not be empty")
+def area_values(patient):
+    """ Returns the values of the placeholders of the areas for the given result, an ExamResult or a dictionary """
+    return {"_" + key: COLORS[patient[key]] for key in KEYS}
+
+
+def patient_values(name, surname, dob, doa, pathological_areas, totals, notes):
+    """ Returns the values of the placeholders of the patient data """
+    return {
+        '_name': name,
+        '_surname': surname,
+        '_dob': dob,
+        '_doa': doa,
+        # The label of the GUI contains rich text, the template already sets the style
+        '_pathological_areas': re.sub(r'<[^>]*>', '', pathological_areas.split(":")[1]),
+        '_n_white': totals[0],
+        '_n_yellow': totals[1],
+        '_n_orange': totals[2],
+        '_n_red': totals[3],
+        '_n_grey': totals[4],
+        '_notes': notes,
+    }
 
-    patient = json.loads(json_dict)
 
-    # Substitute the placeholders with the values
-    for key in KEYS:
-        value = patient[key]
-        html = html.replace("_" + key, COLORS[value])
-    
-    return html
-    
 def generate_output_html(base_html, name, surname, dob, doa, pathological_areas, totals, notes):
-    html = base_html[:]
-    html = html.replace("_name", name)
-    html = html.replace("_surname", surname)
-    html = html.replace("_dob", dob)
-    html = html.replace("_doa", doa)
-    html = html.replace("_pathological_areas", pathological_areas.split(":")[1])
-    html = html.replace("_n_white", totals[0])
-    html = html.replace("_n_yellow", totals[1])
-    html = html.replace("_n_orange", totals[2])
-    html = html.replace("_n_red", totals[3])
-    html = html.replace("_n_grey", totals[4])
-    html = html.replace("_notes", notes)
-
-    html = html.replace("<!--EDITME", "")
-    html = html.replace("EDITME-->", "")
-    
-    return html
+    template = Template(base_html, dict(REPORT_SLOTS))
+    return template.render(patient_values(name, surname, dob, doa, pathological_areas, totals, notes))
+
+
+def render_report(filename, result, name, surname, dob, doa, pathological_areas, totals, notes):
+    """
+    Renders the whole report in a single pass over the precompiled template.
+    Equivalent to generate_output_html(customize_report(filename, result.to_json()), ...)
+
+    :param result: the ExamResult of the patient
+    """
+    values = area_values(result)
+    values.update(patient_values(name, surname, dob, doa, pathological_areas, totals, notes))
+    return load_template(filename, REPORT_SLOTS).render(values)
+
+
+def render_reports(filename, patients):
+    """
+    Renders the reports of many patients with the same template.
+
+    :param patients: list of tuples with the arguments of render_report after filename
+    """
+    return [render_report(filename, *patient) for patient in patients]
 
 
 def export_html(html, output_name):